@@ -8,4 +8,30 @@ from .sc_odict import *
 from .sc_dataframe import *
 from .sc_fileio import *
 from .sc_asd import *
-from .sc_plotting import *
+from .sc_parallel import *
+
+# Import plotting functions only when one is first used, since importing Matplotlib takes most of a second
+_lazymodules = {'sc_plotting': ['processcolors', 'shifthue', 'gridcolors', 'alpinecolormap', 'vectocolor', 'bicolormap', 'hex2rgb',
+                                'boxoff', 'setylim', 'commaticks', 'SItickformatter', 'SIticks', 'savefigs', 'loadfig']} # Must match each module's __all__
+_lazynames = dict([(name, modulename) for modulename,names in _lazymodules.items() for name in names])
+
+__all__ = [name for name in list(globals().keys()) if not name.startswith('_')] + list(_lazynames.keys()) # So "from sciris import *" still includes them
+
+def __getattr__(name):
+    ''' Import the module a lazily loaded name is in, the first time it's used (Python 3.7+) '''
+    modulename = name if name in _lazymodules else _lazynames.get(name) # The module itself, or a name in it
+    if modulename is None:
+        errormsg = "module 'sciris' has no attribute '%s'" % name
+        raise AttributeError(errormsg)
+    import importlib
+    module = importlib.import_module('.' + modulename, __name__)
+    for key in _lazymodules[modulename]:
+        globals()[key] = getattr(module, key)
+    return module if name == modulename else globals()[name]
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(_lazynames.keys()))
+
+import sys as _sys
+if _sys.version_info < (3,7): # Module __getattr__ isn't supported, so import everything now
+    from .sc_plotting import *
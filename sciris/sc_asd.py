@@ -1,7 +1,7 @@
 def asd(function, x, args=None, stepsize=0.1, sinc=2, sdec=2, pinc=2, pdec=2,
     pinitial=None, sinitial=None, xmin=None, xmax=None, maxiters=None, maxtime=None, 
     abstol=1e-6, reltol=1e-3, stalliters=None, stoppingfunc=None, randseed=None, 
-    label=None, fulloutput=True, verbose=2, **kwargs):
+    label=None, fulloutput=True, verbose=2, rng=None, **kwargs):
     """
     Optimization using adaptive stochastic descent (ASD).
     
@@ -37,6 +37,7 @@ def asd(function, x, args=None, stepsize=0.1, sinc=2, sdec=2, pinc=2, pdec=2,
       stalliters     10*n    Number of iterations over which to calculate TolFun (n = number of parameters)
       stoppingfunc   None    External method that can be used to stop the calculation from the outside.
       randseed       None    The random seed to use
+      rng            None    A random generator or seed to use instead of the global random state (see makerng())
       fulloutput     True    Whether or not to return the full output
       verbose        2       How much information to print during the run
       label          None    A label to use to annotate the output
@@ -52,7 +53,10 @@ def asd(function, x, args=None, stepsize=0.1, sinc=2, sdec=2, pinc=2, pdec=2,
     from numpy.random import random, seed
     from time import time
     from .sc_utils import dcp, sigfig
-    if randseed is not None:
+    from .sc_math import makerng
+    if rng is not None:
+        random = makerng(rng).random # Use this generator, and leave the global state alone
+    elif randseed is not None:
         seed(int(randseed)) # Don't reset it if not supplied
         if verbose >= 3: print('Launching ASD with random seed is %i; sample: %f' % (randseed, random()))
 
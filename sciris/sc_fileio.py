@@ -12,13 +12,21 @@ Last update: 5/31/18 (gchadder3)
 import io
 import os
 import re
+import sys
 import pickle
-import dill
 import types
+import uuid
+import zipfile
+import time
+import struct
+import hashlib
+import functools
+import threading
 import numpy as np
 from glob import glob
 from gzip import GzipFile
-from contextlib import closing
+from contextlib import closing, contextmanager
+from collections import OrderedDict
 from . import sc_utils as ut
 from .sc_odict import odict
 from .sc_dataframe import dataframe
@@ -42,71 +50,1232 @@ else: # Python 2
 ### Pickling functions
 ##############################################################################
 
-__all__ = ['loadobj', 'loadstr', 'saveobj', 'dumpstr']
+__all__ = ['loadobj', 'loadstr', 'saveobj', 'dumpstr', 'loadobjs', 'saveobjs', 'SaveQueue', 'savequeue']
 
 
-def loadobj(filename=None, folder=None, verbose=True, die=None):
+def loadobj(filename=None, folder=None, verbose=True, die=None, mmap=False):
     '''
-    Load a saved file.
+    Load a saved file. The compression codec is read from the file header, so files
+    saved with any codec (see saveobj()) -- as well as older gzip files with no header --
+    can be loaded.
+
+    For files saved with saveobj(..., outofband=True), mmap=True memory-maps the array
+    buffers directly from disk rather than reading them (copy-on-write, so the arrays
+    can be modified without changing the file).
 
     Usage:
         obj = loadobj('myfile.obj')
+        obj = loadobj('myarrays.obj', mmap=True)
     '''
     
     # Handle loading of either filename or file object
     if isinstance(filename, _stringtype): 
-        argtype = 'filename'
         filename = makefilepath(filename=filename, folder=folder) # If it is a file, validate the folder
+        with open(filename, 'rb') as rawfile:
+            obj = _loadfromfile(rawfile, die=die, usemmap=mmap)
     else: 
-        argtype = 'fileobj'
-    kwargs = {'mode': 'rb', argtype: filename}
-    with GzipFile(**kwargs) as fileobj:
-        filestr = fileobj.read() # Convert it to a string
-        obj = unpickler(filestr, die=die) # Actually load it
+        obj = _loadfromfile(filename, die=die, usemmap=mmap)
     if verbose: print('Object loaded from "%s"' % filename)
     return obj
 
 
 def loadstr(string=None, die=None):
-    with closing(IO(string)) as output: # Open a "fake file" with the Gzip string pickle in it.
-        with GzipFile(fileobj=output, mode='rb') as fileobj: # Set a Gzip reader to pull from the "file."
-            picklestring = fileobj.read() # Read the string pickle from the "file" (applying Gzip decompression).
-    obj = unpickler(picklestring, die=die) # Return the object gotten from the string pickle.   
+    ''' Load an object from a string created by dumpstr() '''
+    with closing(IO(string)) as output: # Open a "fake file" with the compressed string pickle in it.
+        obj = _loadfromfile(output, die=die)
     return obj
 
 
-def saveobj(filename=None, obj=None, compresslevel=5, verbose=True, folder=None, method='pickle'):
+def saveobj(filename=None, obj=None, compresslevel=None, verbose=True, folder=None, method='pickle', codec=None, outofband=False, compressbuffers=False, nthreads=None, background=False):
     '''
-    Save an object to file -- use compression 5 by default, since more is much slower but not much smaller.
+    Save an object to file -- use gzip compression 5 by default, since more is much slower but not much smaller.
     Once saved, can be loaded with loadobj() (q.v.).
 
+    By default (method='pickle'), the object is pickled. If that fails, the hybrid
+    pickler is tried: this is still the fast C pickler, but uses dill for the objects
+    that pickle can't handle, like lambdas and local functions and classes; and if that
+    fails too, dill is used for the whole object. method='hybrid' or 'dill' starts from
+    that serializer instead. With method='auto', the serializer which worked is remembered
+    for the object's type, so the next time an object of that type is saved, it is used
+    straight away rather than serializing the object more than once. Which serializer
+    was used is recorded in the file, so loadobj() doesn't have to guess.
+
+    The compression codec can be any of 'gzip' (default; alias 'zlib'), 'bz2', 'lzma',
+    or 'none', as well as 'lz4' and 'zstd' if the lz4 or zstandard modules are installed.
+    For example, use codec='none' or 'lz4' for fast temporary saves, and 'lzma' for
+    archives. compresslevel defaults to the codec's default level.
+
+    If outofband=True (Python 3.8+), the buffers of NumPy arrays (and anything else
+    supporting pickle protocol 5) are not copied into the pickle, but are written
+    after it, uncompressed and 64-byte aligned -- so saving and loading array-heavy
+    objects runs at close to disk speed, and loadobj(..., mmap=True) can map them
+    straight from disk. Set compressbuffers=True to compress them with the codec too.
+
+    If nthreads>1, the data is split into 4 MB blocks which are compressed in parallel
+    on that many threads; the result is still a normal file for the codec (e.g. a
+    multi-member gzip file), which loadobj() reads as usual.
+
+    The file is written to a temporary file in the same folder, which replaces the
+    original only once it is complete, so a crash never leaves a truncated file. If
+    background=True, the save runs on a worker thread, and a future is returned
+    straight away -- call future.result() to wait for it and get the path. Don't modify
+    the object until the save is done. See SaveQueue for limiting the number of
+    outstanding saves, and for waiting for them all to finish.
+
     Usage:
         myobj = ['this', 'is', 'a', 'weird', {'object':44}]
         saveobj('myfile.obj', myobj)
+        saveobj('myfile.obj', myobj, codec='zstd', compresslevel=3)
+        saveobj('myarrays.obj', {'x':np.random.rand(int(1e8))}, outofband=True)
+        saveobj('bigproject.obj', project, nthreads=16)
+        future = saveobj('autosave.obj', project, background=True)
     '''
     
     fullpath = makefilepath(filename=filename, folder=folder, sanitize=True)
-    with GzipFile(fullpath, 'wb', compresslevel=compresslevel) as fileobj:
-        if method == 'dill': # If dill is requested, use that
-            savedill(fileobj, obj)
-        else: # Otherwise, try pickle
-            try:    savepickle(fileobj, obj) # Use pickle
-            except: savedill(fileobj, obj) # ...but use Dill if that fails
-        
-    if verbose: print('Object saved to "%s"' % fullpath)
-    return fullpath
+    kwargs = dict(codec=codec, compresslevel=compresslevel, method=method, outofband=outofband, compressbuffers=compressbuffers, nthreads=nthreads)
+    if background:
+        return savequeue.submit(_saveatomic, fullpath, obj, verbose=verbose, key=fullpath, **kwargs) # Saves to the same file are done in order
+    else:
+        return _saveatomic(fullpath, obj, verbose=verbose, **kwargs)
 
 
-def dumpstr(obj=None):
+def dumpstr(obj=None, codec=None, compresslevel=None, method='pickle'):
+    ''' Save an object to a compressed string; see saveobj() for codec and method options '''
     with closing(IO()) as output: # Open a "fake file."
-        with GzipFile(fileobj=output, mode='wb') as fileobj:  # Open a Gzip-compressing way to write to this "file."
-            try:    savepickle(fileobj, obj) # Use pickle
-            except: savedill(fileobj, obj) # ...but use Dill if that fails
+        _savetofile(output, obj, codec=codec, compresslevel=compresslevel, method=method)
         output.seek(0) # Move the mark to the beginning of the "file."
         result = output.read() # Read all of the content into result.
     return result
 
 
+def loadobjs(filelist=None, folder=None, nthreads=None, verbose=True, progress=False, die=False, **kwargs):
+    '''
+    Load many files at once using loadobj(), on nthreads threads (by default, one per
+    CPU; decompression and file I/O release the GIL, so this is much faster than a
+    loop). Returns an odict of the objects, keyed by filename, in the order of filelist.
+    If a file can't be loaded, its entry is the exception raised, unless die=True.
+
+    If progress=True, print each file as it finishes; progress can also be a function,
+    which is called as progress(ndone, ntotal, filename). Other keyword arguments are
+    passed to loadobj().
+
+    Usage:
+        results = loadobjs(getfilelist('results', 'obj'), nthreads=8)
+    '''
+    def load(filename):
+        return loadobj(filename, folder=folder, verbose=False, **kwargs)
+    return _batch(load, ut.promotetolist(filelist), nthreads=nthreads, verbose=verbose, progress=progress, die=die, label='Loaded')
+
+
+def saveobjs(objs=None, folder=None, nthreads=None, verbose=True, progress=False, die=False, **kwargs):
+    '''
+    Save many objects at once using saveobj(), on nthreads threads; objs is a dict of
+    objects keyed by filename. Returns an odict of the full paths saved to, or of the
+    exceptions raised if die=False. See loadobjs() for the other arguments; keyword
+    arguments are passed to saveobj() (e.g. codec).
+
+    Usage:
+        saveobjs({'run1.obj':run1, 'run2.obj':run2}, folder='results', codec='zstd')
+    '''
+    def save(filename):
+        return saveobj(filename, objs[filename], folder=folder, verbose=False, **kwargs)
+    return _batch(save, list(objs.keys()), nthreads=nthreads, verbose=verbose, progress=progress, die=die, label='Saved')
+
+
+def _batch(func=None, filelist=None, nthreads=None, verbose=True, progress=False, die=False, label=None):
+    ''' Call func(filename) for each file in filelist on a thread pool, and return an odict of the results '''
+    from concurrent.futures import ThreadPoolExecutor, as_completed # Python 3 only
+    if nthreads is None: nthreads = os.cpu_count() or 1
+    nthreads = max(1, min(nthreads, len(filelist)))
+    results = {}
+    errors = odict()
+    with ThreadPoolExecutor(max_workers=nthreads) as pool:
+        futures = odict([(pool.submit(func, filename), filename) for filename in filelist])
+        for ndone,future in enumerate(as_completed(futures)):
+            filename = futures[future]
+            try:
+                results[filename] = future.result()
+            except Exception as E:
+                if die:
+                    for otherfuture in futures: otherfuture.cancel()
+                    raise E
+                results[filename] = E
+                errors[filename] = E
+            if callable(progress): progress(ndone+1, len(filelist), filename)
+            elif progress:         print('  %s %i of %i: %s' % (label, ndone+1, len(filelist), filename))
+    if verbose:
+        print('%s %i of %i files' % (label, len(filelist)-len(errors), len(filelist)))
+        for filename,E in errors.items():
+            print('  Failed: %s: %s' % (filename, repr(E)))
+    output = odict([(filename, results[filename]) for filename in filelist]) # Put them back in order
+    return output
+
+
+def _saveatomic(fullpath=None, obj=None, verbose=True, **kwargs):
+    ''' Save to a temporary file in the same folder, then move it into place '''
+    with _atomicwrite(fullpath) as rawfile:
+        _savetofile(rawfile, obj, **kwargs)
+    if verbose: print('Object saved to "%s"' % fullpath)
+    return fullpath
+
+
+@contextmanager
+def _atomicwrite(fullpath=None):
+    ''' Open a temporary file in the same folder as fullpath for writing, and move it into place once closed without error '''
+    folder, basename = os.path.split(fullpath)
+    tmppath = os.path.join(folder, '.%s.%s.tmp' % (basename, uuid.uuid4().hex[:8]))
+    fd = os.open(tmppath, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666) # Usual permissions, unlike tempfile
+    try:
+        with os.fdopen(fd, 'wb') as rawfile:
+            yield rawfile
+        _replacefile(tmppath, fullpath)
+    except:
+        if os.path.exists(tmppath): os.remove(tmppath)
+        raise
+
+
+def _replacefile(src=None, dst=None):
+    ''' Move src to dst, replacing dst if it exists -- atomically, except on Python 2 on Windows, where dst has to be removed first '''
+    if hasattr(os, 'replace'): # Python 3
+        os.replace(src, dst)
+    elif os.name != 'nt': # On POSIX, renaming replaces atomically
+        os.rename(src, dst)
+    else:
+        if os.path.exists(dst): os.remove(dst)
+        os.rename(src, dst)
+    return None
+
+
+class SaveQueue(object):
+    '''
+    The worker threads for saveobj(..., background=True). At most maxpending saves can
+    be outstanding (queued or running) at once; beyond that, saveobj() blocks until one
+    finishes, which also limits the memory held by the queue.
+
+    Example:
+        sc.savequeue.maxpending = 2 # Allow at most 2 outstanding saves
+        sc.saveobj('myfile.obj', myobj, background=True)
+        sc.savequeue.wait() # Wait for all outstanding saves to finish
+    '''
+
+    def __init__(self, maxpending=4):
+        self.maxpending = maxpending # Maximum number of outstanding saves
+        self.pending    = set() # Futures for the outstanding saves
+        self.lastbykey  = {} # The most recent outstanding save for each key (i.e. file)
+        self.executor   = None # Created on first use
+        self.condition  = threading.Condition()
+        return None
+
+    def __repr__(self):
+        return 'SaveQueue: %s of max. %s saves outstanding' % (self.npending(), self.maxpending)
+
+    def npending(self):
+        ''' Number of outstanding saves '''
+        return len(self.pending)
+
+    def submit(self, func=None, *args, key=None, **kwargs):
+        '''
+        Run func(*args, **kwargs) on a worker thread, once there is room in the queue,
+        and return a future. Tasks with the same key (e.g. the path of the file being
+        saved) run one at a time, in the order they were submitted, so an older save
+        can't finish after -- and overwrite -- a newer one.
+        '''
+        from concurrent.futures import ThreadPoolExecutor # Python 3 only
+        with self.condition:
+            while len(self.pending) >= self.maxpending:
+                self.condition.wait()
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.maxpending)
+            previous = self.lastbykey.get(key) if key is not None else None
+            future = self.executor.submit(self._runafter, previous, func, *args, **kwargs)
+            self.pending.add(future)
+            if key is not None: self.lastbykey[key] = future
+        future.add_done_callback(lambda future: self._done(future, key))
+        return future
+
+    @staticmethod
+    def _runafter(previous=None, func=None, *args, **kwargs):
+        ''' Wait for the previous task with the same key, if any, then run this one; the previous task has already started, since tasks start in order '''
+        if previous is not None:
+            from concurrent.futures import wait
+            wait([previous]) # Its result (or exception) is for its own caller
+        return func(*args, **kwargs)
+
+    def wait(self, timeout=None):
+        ''' Wait (up to timeout seconds) for all outstanding saves to finish, and return the number still outstanding '''
+        with self.condition:
+            self.condition.wait_for(lambda: not self.pending, timeout=timeout) # Woken by _done(), once each save is no longer pending
+            return len(self.pending)
+
+    def _done(self, future, key=None):
+        ''' Remove a finished save from the queue, and report it if it failed (otherwise only visible via future.result()) '''
+        with self.condition:
+            self.pending.discard(future)
+            if key is not None and self.lastbykey.get(key) is future:
+                del self.lastbykey[key]
+            self.condition.notify_all()
+        if not future.cancelled() and future.exception() is not None:
+            print('Warning: background save failed: %s' % repr(future.exception()))
+        return None
+
+
+savequeue = SaveQueue()
+
+
+def _savetofile(rawfile=None, obj=None, codec=None, compresslevel=None, method='pickle', outofband=False, compressbuffers=False, nthreads=None):
+    '''
+    Write the header, then the compressed pickle, to an open binary file. The object
+    is pickled straight into the compressor, so the uncompressed pickle is never held
+    in memory; if pickling fails partway, the file is rewound and dill is used instead.
+    Once the serializer is known, it is recorded in the header's flags byte.
+    '''
+    codec = getcodec(codec)
+    flags = 0
+    if outofband:       flags |= _outofbandflag
+    if compressbuffers: flags |= _compressbuffersflag
+    headerstart = rawfile.tell()
+    rawfile.write(_makeheader(codec, flags))
+    if outofband:
+        serializer = _saveoutofband(rawfile, obj, codec=codec, compresslevel=compresslevel, method=method, compressbuffers=compressbuffers, nthreads=nthreads)
+    else:
+        start = rawfile.tell()
+        
+        def dump(savefunc):
+            rawfile.seek(start)
+            rawfile.truncate() # Remove anything written by a previous failed attempt
+            with codec.open(rawfile, 'wb', compresslevel, nthreads=nthreads) as fileobj:
+                savefunc(_Blockwise(fileobj), obj)
+            return None
+        
+        serializer = _serialize(dump, obj, method=method)
+    
+    # Go back and record the serializer in the header
+    if serializer == 'dill':
+        end = rawfile.tell()
+        rawfile.seek(headerstart)
+        rawfile.write(_makeheader(codec, flags | _dillflag))
+        rawfile.seek(end)
+    return None
+
+
+def _serialize(dump=None, obj=None, method='pickle'):
+    '''
+    Call dump(savefunc) with each serializer in turn, starting from method, until one
+    works: pickle, then the hybrid pickler, then dill. Return the serializer used. With
+    method='auto', start from whichever serializer last worked for this type of object.
+    '''
+    if method not in list(_serializers.keys()) + ['auto']:
+        errormsg = 'Method "%s" not recognized: must be one of %s or "auto"' % (method, list(_serializers.keys()))
+        raise Exception(errormsg)
+    objtype = type(obj)
+    if method == 'auto':
+        method = _serializercache.get(objtype, 'pickle')
+    candidates = _serializers.keys()[_serializers.keys().index(method):]
+    for serializer in candidates:
+        try:
+            dump(_serializers[serializer])
+            break
+        except:
+            if serializer == candidates[-1]: raise # Nothing left to try
+    if serializer != method: # Had to fall back, so remember this for next time
+        _serializercache[objtype] = serializer
+    return serializer
+
+
+def _loadfromfile(rawfile=None, die=None, usemmap=False):
+    ''' Read the header, then unpickle straight from the decompressor '''
+    codec, flags, serializer = _readheader(rawfile)
+    if flags & _outofbandflag:
+        return _loadoutofband(rawfile, codec=codec, compressbuffers=flags & _compressbuffersflag, serializer=serializer, die=die, usemmap=usemmap)
+    elif usemmap:
+        print('Warning: mmap=True only applies to files saved with outofband=True; loading normally')
+    start = rawfile.tell()
+    
+    @contextmanager
+    def openfile():
+        rawfile.seek(start) # Each attempt starts from the beginning of the compressed stream
+        with codec.open(rawfile, 'rb') as fileobj:
+            yield _Blockwise(fileobj)
+    
+    obj = _unpicklefile(openfile, die=die, serializer=serializer) # Actually load it
+    return obj
+
+
+def _saveoutofband(rawfile=None, obj=None, codec=None, compresslevel=None, method='pickle', compressbuffers=False, nthreads=None):
+    '''
+    Save using pickle protocol 5 with out-of-band buffers. After the header, the layout is:
+    the length of the compressed pickle and the number of buffers (8 bytes each); an
+    index of (stored length, raw length) for each buffer (16 bytes each); the compressed
+    pickle; then each buffer, starting on a 64-byte boundary. Returns the serializer used.
+    '''
+    
+    result = {}
+    def dump(savefunc):
+        buffers = [] # Appending returns None, which tells pickle to store the buffer out-of-band
+        with closing(IO()) as output:
+            savefunc(output, obj, protocol=5, buffer_callback=buffers.append)
+            result['picklestr'] = output.getvalue() # Small, since it doesn't include the buffers
+        result['buffers'] = buffers
+        return None
+    
+    serializer = _serialize(dump, obj, method=method)
+    picklestr, buffers = result['picklestr'], result['buffers']
+    
+    # Write the compressed pickle, leaving space for the index
+    with closing(IO()) as output:
+        with codec.open(output, 'wb', compresslevel) as fileobj:
+            fileobj.write(picklestr)
+        compressed = output.getvalue()
+    rawfile.write(struct.pack('<QQ', len(compressed), len(buffers)))
+    indexpos = rawfile.tell()
+    rawfile.write(b'\0'*16*len(buffers))
+    rawfile.write(compressed)
+    
+    # Write the buffers, then go back and fill in the index
+    index = []
+    for buffer in buffers:
+        rawfile.write(b'\0'*(_aligned(rawfile.tell()) - rawfile.tell()))
+        view = buffer.raw() # A flat, contiguous view of the array's memory
+        start = rawfile.tell()
+        if compressbuffers:
+            with codec.open(rawfile, 'wb', compresslevel, nthreads=nthreads) as fileobj:
+                _Blockwise(fileobj).write(view)
+        else:
+            _Blockwise(rawfile).write(view)
+        index.append(struct.pack('<QQ', rawfile.tell()-start, len(view)))
+    end = rawfile.tell()
+    rawfile.seek(indexpos)
+    rawfile.write(b''.join(index))
+    rawfile.seek(end)
+    return serializer
+
+
+def _loadoutofband(rawfile=None, codec=None, compressbuffers=False, serializer=None, die=None, usemmap=False):
+    ''' Load a file written by _saveoutofband(), reading each buffer directly into the memory the arrays will use '''
+    picklelen, nbuffers = struct.unpack('<QQ', rawfile.read(16))
+    index = [struct.unpack('<QQ', rawfile.read(16)) for b in range(nbuffers)]
+    compressed = rawfile.read(picklelen)
+    
+    # Optionally memory-map the file
+    if usemmap:
+        if compressbuffers:
+            errormsg = 'Cannot memory-map buffers that were saved with compressbuffers=True'
+            raise Exception(errormsg)
+        import mmap
+        mapped = memoryview(mmap.mmap(rawfile.fileno(), 0, access=mmap.ACCESS_COPY)) # Copy-on-write, so the file is never modified
+    
+    # Read the buffers
+    buffers = []
+    for storedlen,rawlen in index:
+        start = _aligned(rawfile.tell())
+        rawfile.seek(start)
+        if usemmap:
+            buffer = mapped[start:start+rawlen]
+        else:
+            buffer = bytearray(rawlen)
+            if compressbuffers:
+                with codec.open(rawfile, 'rb') as fileobj:
+                    _Blockwise(fileobj).readinto(buffer)
+            else:
+                rawfile.readinto(buffer)
+        buffers.append(buffer)
+        rawfile.seek(start+storedlen)
+    
+    @contextmanager
+    def openfile():
+        with codec.open(IO(compressed), 'rb') as fileobj:
+            yield fileobj
+    
+    obj = _unpicklefile(openfile, die=die, buffers=buffers, serializer=serializer)
+    return obj
+
+
+def _aligned(position=None, alignment=64):
+    ''' The next position in a file that is a multiple of alignment '''
+    return -(-position//alignment)*alignment
+
+
+
+
+##############################################################################
+### Compression codecs
+##############################################################################
+
+__all__ += ['registercodec', 'getcodec']
+
+
+_objmagic   = b'SCIRIS' # Start of the header written by saveobj() and dumpstr(); files without it are legacy gzip files
+_objversion = 1 # Version of the header format
+_outofbandflag = 1 # Header flag: array buffers are stored after the pickle
+_compressbuffersflag = 2 # Header flag: out-of-band buffers are also compressed
+_dillflag = 4 # Header flag: the payload was written by dill rather than pickle
+_serializercache = {} # The serializer which last worked for each type, for saveobj(..., method='auto')
+_codecs = odict() # The registered codecs, keyed by name
+_codecaliases = {'zlib':'gzip', 'gz':'gzip', 'xz':'lzma', 'zstandard':'zstd', None:'gzip'}
+
+
+class Codec(object):
+    '''
+    A compression codec for saveobj() and friends. opener(fileobj, mode, level) must
+    return a file object which compresses into (mode 'wb') or decompresses from
+    (mode 'rb') the open file fileobj, and which does not close fileobj when closed.
+    codecid is the byte written to the file header to identify the codec.
+
+    Optionally, compressor(data, level) compresses a block of data in one go; if
+    supplied, and if the codec can read concatenated streams, the codec can be used
+    to compress with multiple threads (see saveobj(..., nthreads=)).
+    '''
+
+    def __init__(self, name=None, codecid=None, opener=None, level=None, compressor=None):
+        self.name   = name # Name of the codec, e.g. 'gzip'
+        self.id     = codecid # Integer 0-255 stored in the file header
+        self.opener = opener # Function to open a compressed file object
+        self.level  = level # Default compression level
+        self.compressor = compressor # Function to compress a single block
+        return None
+
+    def __repr__(self):
+        return ut.prepr(self)
+
+    def open(self, fileobj=None, mode='rb', level=None, nthreads=None):
+        ''' Open a compressing or decompressing file object on top of fileobj, compressing on nthreads threads if >1 '''
+        if level is None: level = self.level
+        if nthreads is not None and nthreads > 1 and 'w' in mode and self.id != _codecs['none'].id:
+            if self.compressor is None:
+                errormsg = 'Codec "%s" does not support multithreaded compression; use e.g. gzip or zstd instead' % self.name
+                raise Exception(errormsg)
+            return _ParallelWriter(fileobj, compressor=self.compressor, level=level, nthreads=nthreads)
+        return self.opener(fileobj, mode, level)
+
+
+def registercodec(name=None, codecid=None, opener=None, level=None, compressor=None, overwrite=False):
+    '''
+    Register a compression codec for use with saveobj(), loadobj(), dumpstr(), and
+    loadstr(); see Codec for the requirements on opener. Built-in codecs use IDs
+    0-15, so use 16-255 for custom ones.
+
+    Example:
+        import snappy
+        def snappyopener(fileobj, mode, level):
+            if 'w' in mode: return snappy.StreamCompressor(...) # etc.
+        sc.registercodec('snappy', 16, snappyopener)
+        sc.saveobj('myfile.obj', myobj, codec='snappy')
+    '''
+    for existing in _codecs.values():
+        if not overwrite and (existing.name == name or existing.id == codecid):
+            errormsg = 'Codec "%s" (ID %s) clashes with existing codec "%s" (ID %s); use overwrite=True to replace it' % (name, codecid, existing.name, existing.id)
+            raise Exception(errormsg)
+    _codecs[name] = Codec(name=name, codecid=codecid, opener=opener, level=level, compressor=compressor)
+    return _codecs[name]
+
+
+def getcodec(codec=None):
+    ''' Return a registered codec by name (default gzip), or by the ID stored in a file header '''
+    if isinstance(codec, Codec):
+        return codec
+    elif isinstance(codec, int):
+        for thiscodec in _codecs.values():
+            if thiscodec.id == codec:
+                return thiscodec
+        errormsg = 'File was saved with codec ID %s, which is not registered; available codecs are: %s' % (codec, _codecs.keys())
+        raise Exception(errormsg)
+    else:
+        name = _codecaliases.get(codec, codec)
+        try:
+            return _codecs[name]
+        except:
+            errormsg = 'Codec "%s" not found; available codecs are: %s' % (codec, _codecs.keys())
+            raise Exception(errormsg)
+
+
+def _makeheader(codec=None, flags=0):
+    ''' The header is the magic string, followed by a version byte, a codec byte, and a flags byte '''
+    return _objmagic + bytearray([_objversion, codec.id, flags])
+
+
+def _readheader(rawfile=None):
+    '''
+    Read the header and return the codec, flags, and serializer ('pickle' or 'dill'); if
+    there is no header, it's a legacy gzip file, and the serializer is unknown (None).
+    '''
+    start = rawfile.tell()
+    header = bytearray(rawfile.read(len(_objmagic)+3))
+    if bytes(header[:len(_objmagic)]) == _objmagic:
+        version, codecid, flags = header[-3:]
+        if version > _objversion:
+            errormsg = 'File was saved with a newer version of Sciris (file format %s > %s); please upgrade' % (version, _objversion)
+            raise Exception(errormsg)
+        serializer = 'dill' if flags & _dillflag else 'pickle'
+        return getcodec(int(codecid)), flags, serializer
+    else:
+        rawfile.seek(start) # Rewind, since this is part of the gzip stream
+        return getcodec('gzip'), 0, None
+
+
+class _Blockwise(object):
+    '''
+    Wrap a compressing or decompressing file object so that large buffers (e.g. the
+    contents of NumPy arrays) are passed through it in fixed-size blocks, rather than
+    all at once -- this stops the compressor from needing a second copy of the buffer.
+    '''
+    blocksize = 2**20 # 1 MB
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        return None
+
+    def write(self, data):
+        view = memoryview(data)
+        if view.ndim != 1 or view.format != 'B': view = view.cast('B')
+        for i in range(0, len(view), self.blocksize):
+            self.fileobj.write(view[i:i+self.blocksize])
+        return len(view)
+
+    def read(self, size=-1):
+        return self.fileobj.read(size)
+
+    def readline(self, size=-1):
+        return self.fileobj.readline(size)
+
+    def readinto(self, b):
+        view = memoryview(b)
+        if view.ndim != 1 or view.format != 'B': view = view.cast('B')
+        count = 0
+        while count < len(view):
+            block = self.fileobj.read(min(self.blocksize, len(view)-count))
+            if not block: break # End of file
+            view[count:count+len(block)] = block
+            count += len(block)
+        return count
+
+
+class _ParallelWriter(object):
+    '''
+    A file object that splits what is written to it into blocks, compresses each block
+    independently on a thread pool (zlib and the other compressors release the GIL),
+    and writes the compressed blocks in order. The output is a series of concatenated
+    streams, which the codec's normal reader decompresses as one -- e.g. a multi-member
+    gzip file, as written by pigz. At most 2*nthreads blocks are held in memory at once.
+    '''
+    blocksize = 2**22 # 4 MB: large enough that the compression ratio barely suffers
+
+    def __init__(self, fileobj=None, compressor=None, level=None, nthreads=None):
+        from concurrent.futures import ThreadPoolExecutor # Python 3 only
+        from collections import deque
+        self.fileobj    = fileobj
+        self.compressor = compressor
+        self.level      = level
+        self.maxpending = 2*nthreads
+        self.pool       = ThreadPoolExecutor(max_workers=nthreads)
+        self.pending    = deque() # Futures for the blocks being compressed, in order
+        self.buffer     = bytearray() # Data waiting to fill a block
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return None
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.blocksize:
+            self._submit(bytes(self.buffer[:self.blocksize]))
+            del self.buffer[:self.blocksize]
+        return len(data)
+
+    def _submit(self, block):
+        self.pending.append(self.pool.submit(self.compressor, block, self.level))
+        while len(self.pending) > self.maxpending: # Don't get too far ahead of the disk
+            self.fileobj.write(self.pending.popleft().result())
+        return None
+
+    def close(self):
+        try:
+            if self.buffer:
+                self._submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+        finally:
+            self.pool.shutdown()
+        return None
+
+
+class _Uncompressed(object):
+    ''' A thin wrapper so that the "none" codec doesn't close the underlying file '''
+    def __init__(self, fileobj): self.fileobj = fileobj
+    def __enter__(self): return self
+    def __exit__(self, *args): return None
+    def __getattr__(self, attr): return getattr(self.fileobj, attr)
+    def close(self): return None
+
+
+def _importcodec(name=None, modulename=None):
+    ''' Import the module for an optional codec, with a helpful message if it's not installed '''
+    import importlib
+    try:
+        return importlib.import_module(modulename)
+    except Exception as E:
+        errormsg = 'Cannot use the %s codec since the %s module could not be imported (%s); please install it and try again' % (name, modulename, repr(E))
+        raise Exception(errormsg)
+
+def _gzipopener(fileobj, mode, level):
+    return GzipFile(fileobj=fileobj, mode=mode, compresslevel=level)
+
+def _gzipcompressor(data, level):
+    import gzip
+    return gzip.compress(data, compresslevel=level) # Python 3 only
+
+def _bz2opener(fileobj, mode, level):
+    import bz2
+    if 'w' in mode: return bz2.BZ2File(fileobj, mode='wb', compresslevel=level)
+    else:           return bz2.BZ2File(fileobj, mode='rb')
+
+def _bz2compressor(data, level):
+    import bz2
+    return bz2.compress(data, compresslevel=level)
+
+def _lzmaopener(fileobj, mode, level):
+    import lzma # Python 3 only
+    if 'w' in mode: return lzma.LZMAFile(fileobj, mode='wb', preset=level)
+    else:           return lzma.LZMAFile(fileobj, mode='rb')
+
+def _lzmacompressor(data, level):
+    import lzma
+    return lzma.compress(data, preset=level)
+
+def _noneopener(fileobj, mode, level):
+    return _Uncompressed(fileobj)
+
+def _lz4opener(fileobj, mode, level):
+    lz4frame = _importcodec('lz4', 'lz4.frame')
+    return lz4frame.LZ4FrameFile(fileobj, mode=mode, compression_level=level)
+
+def _lz4compressor(data, level):
+    lz4frame = _importcodec('lz4', 'lz4.frame')
+    return lz4frame.compress(data, compression_level=level)
+
+def _zstdopener(fileobj, mode, level):
+    zstandard = _importcodec('zstd', 'zstandard')
+    if 'w' in mode: return zstandard.ZstdCompressor(level=level).stream_writer(fileobj, closefd=False)
+    else:           return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False, read_across_frames=True))
+
+def _zstdcompressor(data, level):
+    zstandard = _importcodec('zstd', 'zstandard')
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+registercodec('none', 0, _noneopener)
+registercodec('gzip', 1, _gzipopener, level=5, compressor=_gzipcompressor) # More compression is much slower but not much smaller
+registercodec('bz2',  2, _bz2opener,  level=9, compressor=_bz2compressor)
+registercodec('lzma', 3, _lzmaopener, level=6, compressor=_lzmacompressor)
+registercodec('lz4',  4, _lz4opener,  level=0, compressor=_lz4compressor)
+registercodec('zstd', 5, _zstdopener, level=3, compressor=_zstdcompressor)
+
+
+
+
+##############################################################################
+### Archives
+##############################################################################
+
+__all__ += ['Archive', 'savearchive', 'loadarchive']
+
+
+def savearchive(filename=None, obj=None, folder=None, codec=None, compresslevel=None, method='pickle', verbose=True):
+    '''
+    Save a dict or odict as an archive, in which each value is pickled and compressed
+    separately (as by dumpstr()), so it can be loaded on its own; see loadarchive().
+    The archive is a zip file, with the key order stored as an index entry.
+
+    Usage:
+        savearchive('scenarios.arc', scenarios) # e.g. an odict of 200 scenarios
+    '''
+    fullpath = makefilepath(filename=filename, folder=folder, sanitize=True)
+    entries = OrderedDict() # Not an odict, so keys can be integers
+    with _atomicwrite(fullpath) as rawfile:
+        with zipfile.ZipFile(rawfile, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf: # Entries are already compressed
+            for key,value in obj.items():
+                entries[key] = '%i.obj' % len(entries)
+                zf.writestr(entries[key], dumpstr(value, codec=codec, compresslevel=compresslevel, method=method))
+            zf.writestr(Archive._indexentry(0), dumpstr(list(entries.items())))
+    if verbose: print('Archive saved to "%s"' % fullpath)
+    return fullpath
+
+
+def loadarchive(filename=None, folder=None):
+    '''
+    Open an archive saved by savearchive(). Only the index is read: each value is
+    loaded from the file the first time it's accessed. See Archive.
+
+    Usage:
+        scenarios = loadarchive('scenarios.arc')
+        baseline = scenarios['Baseline'] # Only this scenario is loaded
+    '''
+    fullpath = makefilepath(filename=filename, folder=folder)
+    return Archive(fullpath)
+
+
+class Archive(object):
+    '''
+    An odict-like view of an archive file created by savearchive(). Values are loaded
+    on first access (by key or by index) and then kept; keys(), len(), and "in" never
+    load anything, while values() and items() load everything.
+
+    update(key, value) (or archive[key] = value) appends the new value to the file,
+    leaving the other entries untouched. The space used by any value it replaces is
+    only reclaimed by compact(), which rewrites the whole file.
+
+    savearchive() and compact() replace the file atomically, but update() and
+    remove() change it in place, overwriting the zip file's directory at the end. If
+    they raise an exception, the original directory is put back, so the file is as it
+    was; but if the process is killed or the computer crashes partway through, the
+    directory may be lost, making the whole archive unreadable. Keep a copy (or use
+    savearchive()) if that matters.
+
+    Example:
+        scens = sc.loadarchive('scenarios.arc')
+        scens.update('Baseline', newbaseline)
+        scens.compact()
+        allscens = scens.toodict()
+    '''
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.lock     = threading.RLock() # Entries can be loaded from several threads
+        self._loaded  = {} # Values loaded so far, by key
+        self._readindex()
+        return None
+
+    def __repr__(self):
+        return 'Archive "%s": %i keys (%i loaded)\n%s' % (self.filename, len(self), len(self._loaded), self.keys())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getitem__(self, key):
+        if isinstance(key, ut._numtype) and key not in self._entries: # Allow numerical indexing, as for odicts
+            key = self.keys()[int(key)]
+        with self.lock:
+            if key not in self._loaded:
+                if key not in self._entries:
+                    errormsg = 'Key "%s" not found; available keys are:\n%s' % (ut.flexstr(key), '\n'.join([ut.flexstr(k) for k in self.keys()]))
+                    raise Exception(errormsg)
+                with zipfile.ZipFile(self.filename, 'r') as zf:
+                    self._loaded[key] = loadstr(zf.read(self._entries[key]))
+            return self._loaded[key]
+
+    def __setitem__(self, key, value):
+        return self.update(key, value)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return list(self._entries.keys())
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def isloaded(self, key):
+        ''' Whether the value for this key has been loaded yet '''
+        return key in self._loaded
+
+    def toodict(self):
+        ''' Load everything, and return it as an odict '''
+        return odict(self.items())
+
+    def update(self, key, value, codec=None, compresslevel=None, method='pickle'):
+        ''' Add or replace the value for this key, writing only the new entry and index to the file '''
+        with self.lock:
+            string = dumpstr(value, codec=codec, compresslevel=compresslevel, method=method)
+            with self._append() as zf:
+                nentries = len(zf.namelist())
+                entryname = '%i.obj' % nentries # Entry names are never reused
+                entries = OrderedDict(self._entries)
+                entries[key] = entryname
+                zf.writestr(entryname, string)
+                zf.writestr(self._indexentry(nentries+1), dumpstr(list(entries.items())))
+            self._entries = entries
+            self._loaded[key] = value
+        return None
+
+    def remove(self, key):
+        ''' Remove this key, by writing a new index to the file '''
+        with self.lock:
+            entries = OrderedDict(self._entries)
+            entries.pop(key)
+            with self._append() as zf:
+                zf.writestr(self._indexentry(len(zf.namelist())), dumpstr(list(entries.items())))
+            self._entries = entries
+            self._loaded.pop(key, None)
+        return None
+
+    def compact(self):
+        ''' Rewrite the file with only the current entries, reclaiming the space used by replaced and removed ones '''
+        with self.lock:
+            entries = OrderedDict()
+            with zipfile.ZipFile(self.filename, 'r') as oldzf, _atomicwrite(self.filename) as rawfile:
+                with zipfile.ZipFile(rawfile, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+                    for key,oldname in self._entries.items():
+                        entries[key] = '%i.obj' % len(entries)
+                        zf.writestr(entries[key], oldzf.read(oldname)) # Copied as is, without unpickling
+                    zf.writestr(self._indexentry(len(entries)), dumpstr(list(entries.items())))
+            self._entries = entries
+        return None
+
+    @contextmanager
+    def _append(self):
+        ''' Open the file for appending; if anything goes wrong, put back the original directory (which appending overwrites) '''
+        with zipfile.ZipFile(self.filename, 'r') as zf:
+            start = zf.start_dir # Where the directory starts; new entries are written from here
+        with open(self.filename, 'rb') as rawfile:
+            rawfile.seek(start)
+            tail = rawfile.read() # The directory and end record
+        try:
+            with zipfile.ZipFile(self.filename, 'a', zipfile.ZIP_STORED, allowZip64=True) as zf:
+                yield zf
+        except:
+            with open(self.filename, 'r+b') as rawfile: # The entries before start are untouched, so this restores the file
+                rawfile.seek(start)
+                rawfile.write(tail)
+                rawfile.truncate()
+            raise
+
+    @staticmethod
+    def _indexentry(n=None):
+        ''' Name of an index entry; n is the number of entries before it, so names are never reused '''
+        return 'index.%i' % n
+
+    def _readindex(self):
+        ''' Read the current index -- the last one in the file -- which maps each key to the name of its entry '''
+        with zipfile.ZipFile(self.filename, 'r') as zf:
+            index = [info for info in zf.infolist() if info.filename.startswith('index.')]
+            if not index:
+                errormsg = 'File "%s" is not an archive saved by savearchive()' % self.filename
+                raise Exception(errormsg)
+            self._entries = OrderedDict(loadstr(zf.read(index[-1])))
+        return None
+
+
+
+
+##############################################################################
+### Deduplicating object store
+##############################################################################
+
+__all__ += ['ObjectStore']
+
+
+class ObjectStore(object):
+    '''
+    A folder of saved objects in which the data are split into chunks, each stored
+    once under the hash of its contents. The object is pickled with its array buffers
+    out-of-band (as by saveobj(..., outofband=True)); the pickle and each buffer are
+    cut into chunks of chunksize bytes, and only chunks that aren't already in the
+    store are compressed and written, along with a small manifest listing the chunks.
+    Saving a new version of a large object, in which most of the arrays haven't
+    changed, therefore only writes the arrays that have. Chunks no longer used by
+    any saved object are deleted by gc(). Requires Python 3.8+.
+
+    Several processes can save to the same store, but gc() could delete a chunk that
+    a save() running at the same time has just written (or found already there) but
+    not yet listed in its manifest. To avoid this, gc() only deletes chunks which
+    haven't been written or reused for minage seconds (default 10 minutes); only use
+    minage=0 when nothing else is saving to the store.
+
+    The folder contains a "manifests" folder, with one file per saved name, and a
+    "chunks" folder, with one file per chunk.
+
+    Example:
+        store = sc.ObjectStore('autosaves')
+        store.save('project', project) # Writes everything
+        project.name = 'New name'
+        store.save('project', project) # Writes only the chunks containing the name
+        project = store.load('project')
+        store.remove('oldproject')
+        store.gc() # Deletes the chunks only oldproject used
+    '''
+    chunksize = 2**20 # 1 MB
+
+    def __init__(self, folder=None, codec=None, compresslevel=None):
+        self.folder        = os.path.abspath(os.path.expanduser(folder))
+        self.codec         = getcodec(codec)
+        self.compresslevel = compresslevel
+        for subfolder in ['manifests', 'chunks']:
+            if not os.path.isdir(os.path.join(self.folder, subfolder)):
+                os.makedirs(os.path.join(self.folder, subfolder))
+        return None
+
+    def __repr__(self):
+        return 'ObjectStore "%s": %s' % (self.folder, self.keys())
+
+    def __contains__(self, name):
+        return os.path.exists(self._manifestpath(name))
+
+    def keys(self):
+        ''' Names of the saved objects '''
+        return sorted([name for name in os.listdir(os.path.join(self.folder, 'manifests')) if not name.startswith('.')]) # Skip temporary files, e.g. from a save that was killed
+
+    def save(self, name=None, obj=None, method='pickle', verbose=False):
+        ''' Save an object under this name, writing only the chunks which aren't already in the store; returns the number of bytes written '''
+        result = {}
+        def dump(savefunc):
+            buffers = []
+            with closing(IO()) as output:
+                savefunc(output, obj, protocol=5, buffer_callback=buffers.append)
+                result['picklestr'] = output.getvalue()
+            result['buffers'] = buffers
+            return None
+        
+        serializer = _serialize(dump, obj, method=method)
+        nbytes = [0] # Number of bytes written
+        manifest = odict()
+        manifest['serializer'] = serializer
+        manifest['pickle'] = self._savechunks(memoryview(result['picklestr']), nbytes)
+        manifest['buffers'] = []
+        for buffer in result['buffers']:
+            view = buffer.raw()
+            manifest['buffers'].append((len(view), self._savechunks(view, nbytes)))
+        with _atomicwrite(self._manifestpath(name)) as rawfile:
+            _savetofile(rawfile, manifest)
+        if verbose: print('Object saved to store "%s" as "%s" (%s bytes of new chunks)' % (self.folder, name, nbytes[0]))
+        return nbytes[0]
+
+    def load(self, name=None, die=None, verbose=False):
+        ''' Load the object saved under this name '''
+        if name not in self:
+            errormsg = 'Object "%s" not found in store "%s"; available objects are: %s' % (name, self.folder, self.keys())
+            raise Exception(errormsg)
+        with open(self._manifestpath(name), 'rb') as rawfile:
+            manifest = _loadfromfile(rawfile, die=True)
+        picklestr = self._loadchunks(manifest['pickle'])
+        buffers = [self._loadchunks(hashes, bytearray(rawlen)) for rawlen,hashes in manifest['buffers']]
+        obj = _unpicklefile(lambda: closing(IO(picklestr)), die=die, buffers=buffers, serializer=manifest['serializer'])
+        if verbose: print('Object "%s" loaded from store "%s"' % (name, self.folder))
+        return obj
+
+    def remove(self, name=None):
+        ''' Remove the object saved under this name; its chunks are deleted by the next gc() '''
+        os.remove(self._manifestpath(name))
+        return None
+
+    def gc(self, minage=600, verbose=True):
+        ''' Delete all chunks not used by any saved object, and not written or reused in the last minage seconds, and return the number of bytes freed '''
+        used = set()
+        for name in self.keys():
+            with open(self._manifestpath(name), 'rb') as rawfile:
+                manifest = _loadfromfile(rawfile, die=True)
+            used.update(manifest['pickle'])
+            for rawlen,hashes in manifest['buffers']:
+                used.update(hashes)
+        nfiles = 0
+        nbytes = 0
+        cutoff = time.time() - minage
+        for chunkfile in glob(os.path.join(self.folder, 'chunks', '*', '*')): # Skips temporary files, which start with "."
+            if os.path.basename(chunkfile) not in used:
+                try:
+                    if os.path.getmtime(chunkfile) > cutoff: continue # Possibly part of a save in progress
+                    filebytes = os.path.getsize(chunkfile)
+                    os.remove(chunkfile)
+                except OSError:
+                    continue # Removed by another gc() in the meantime
+                nfiles += 1
+                nbytes += filebytes
+        if verbose: print('Removed %i unused chunks (%s bytes) from store "%s"' % (nfiles, nbytes, self.folder))
+        return nbytes
+
+    def _manifestpath(self, name=None):
+        return os.path.join(self.folder, 'manifests', sanitizefilename(name))
+
+    def _chunkpath(self, chunkhash=None):
+        return os.path.join(self.folder, 'chunks', chunkhash[:2], chunkhash) # Split into subfolders, to keep each one a manageable size
+
+    def _savechunks(self, view=None, nbytes=None):
+        ''' Split a buffer into chunks, write any new ones, and return their hashes '''
+        hashes = []
+        for start in range(0, len(view), self.chunksize):
+            chunk = view[start:start+self.chunksize]
+            chunkhash = hashlib.blake2b(chunk, digest_size=20).hexdigest()
+            chunkpath = self._chunkpath(chunkhash)
+            try:
+                os.utime(chunkpath, None) # Mark it as in use, so gc() doesn't delete it before the manifest is written
+            except OSError: # Not there yet
+                if not os.path.isdir(os.path.dirname(chunkpath)):
+                    os.makedirs(os.path.dirname(chunkpath), exist_ok=True)
+                with _atomicwrite(chunkpath) as rawfile:
+                    rawfile.write(_makeheader(self.codec))
+                    with self.codec.open(rawfile, 'wb', self.compresslevel) as fileobj:
+                        fileobj.write(chunk)
+                nbytes[0] += os.path.getsize(chunkpath)
+            hashes.append(chunkhash)
+        return hashes
+
+    def _loadchunks(self, hashes=None, output=None):
+        ''' Read the chunks into output (by default, a new bytearray) '''
+        if output is None: output = bytearray()
+        position = 0
+        for chunkhash in hashes:
+            with open(self._chunkpath(chunkhash), 'rb') as rawfile:
+                codec, flags, serializer = _readheader(rawfile)
+                with codec.open(rawfile, 'rb') as fileobj:
+                    chunk = fileobj.read()
+            output[position:position+len(chunk)] = chunk
+            position += len(chunk)
+        return output
+
+
+
+
+##############################################################################
+### Disk cache
+##############################################################################
+
+__all__ += ['diskcache']
+
+
+def diskcache(func=None, folder=None, maxbytes=None, codec=None, method='pickle', verbose=False):
+    '''
+    Cache the results of a function on disk, so calling it again with the same
+    arguments -- in this process, another process, or a later session -- loads the
+    saved result instead of recomputing it. Each result is saved with saveobj() in its
+    own file in folder (by default ~/.cache/sciris), named after a hash of the
+    function -- its name, source code, defaults, and the values of any variables it
+    closes over -- and of its arguments (see hashobj(), so they can include arrays,
+    odicts, and other objects). Changing the function's source code therefore means
+    its old results aren't used.
+
+    Files are written atomically, so several processes can share the folder: they
+    never see partly written results, and at worst compute the same result twice. If
+    maxbytes is given, the least recently used results are deleted once the files in
+    the folder add up to more than this. Calls with arguments which can't be hashed
+    (e.g. generators), and results which can't be saved, aren't cached.
+
+    The decorated function has cache_info(), which returns the number of hits and
+    misses in this process and the number and size of the files in the folder, and
+    cache_clear(), which deletes this function's results.
+
+    Examples:
+        @sc.diskcache
+        def runmodel(pars, years): ...
+
+        @sc.diskcache(folder='/data/cache', maxbytes=10e9, codec='zstd')
+        def calibrate(data, pars): ...
+    '''
+    if func is None: # Used as @diskcache(...) rather than @diskcache
+        return lambda func: diskcache(func, folder=folder, maxbytes=maxbytes, codec=codec, method=method, verbose=verbose)
+    
+    # Work out where to store the results, and what identifies this function
+    if folder is None: folder = os.path.join('~', '.cache', 'sciris')
+    folder = os.path.abspath(os.path.expanduser(folder))
+    name = getattr(func, '__qualname__', func.__name__)
+    prefix = sanitizefilename(name).replace('<', '').replace('>', '') + '.'
+    try:
+        import inspect
+        source = inspect.getsource(func)
+    except Exception:
+        source = None # E.g. defined interactively
+    funcid = (func.__module__, name, source)
+    stats = OrderedDict([('hits', 0), ('misses', 0)])
+    lock = threading.Lock()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            key = ut.hashobj((funcid, func, args, kwargs)) # The function itself includes its defaults and closure, which can change between calls
+        except Exception as E:
+            print('Warning: could not hash the arguments of %s, so calling it without the cache: %s' % (name, repr(E)))
+            with lock: stats['misses'] += 1
+            return func(*args, **kwargs)
+        filepath = os.path.join(folder, prefix + key + '.obj')
+        
+        # Load the result, if it's there
+        try:
+            with open(filepath, 'rb') as rawfile:
+                result = _loadfromfile(rawfile, die=True)
+            try:    os.utime(filepath, None) # Mark it as recently used
+            except: pass # Deleted by another process in the meantime
+            with lock: stats['hits'] += 1
+            if verbose: print('Loaded cached result from "%s"' % filepath)
+            return result
+        except (IOError, OSError): # Not there
+            pass
+        except Exception as E:
+            print('Warning: could not load cached result from "%s", recomputing: %s' % (filepath, repr(E)))
+        with lock: stats['misses'] += 1
+        
+        # Otherwise, compute and save it
+        result = func(*args, **kwargs)
+        try:
+            if not os.path.isdir(folder):
+                try:    os.makedirs(folder)
+                except: pass # Created by another process in the meantime
+            _saveatomic(filepath, result, verbose=verbose, codec=codec, method=method)
+            if maxbytes is not None:
+                _evictdiskcache(folder, maxbytes)
+        except Exception as E:
+            print('Warning: could not save result to the cache in "%s": %s' % (folder, repr(E)))
+        return result
+
+    def cache_info():
+        ''' Return the number of hits and misses in this process, and the number and size of all the files in the cache folder '''
+        files = _diskcachefiles(folder)
+        output = OrderedDict(stats)
+        output['nfiles'] = len(files)
+        output['nbytes'] = sum([nbytes for filepath,nbytes,mtime in files])
+        return output
+
+    def cache_clear():
+        ''' Delete the saved results of this function '''
+        for filepath,nbytes,mtime in _diskcachefiles(folder):
+            if os.path.basename(filepath).startswith(prefix):
+                try:    os.remove(filepath)
+                except: pass
+        with lock:
+            for key in stats: stats[key] = 0
+        return None
+
+    wrapper.cache_info  = cache_info
+    wrapper.cache_clear = cache_clear
+    return wrapper
+
+
+def _diskcachefiles(folder=None):
+    ''' List the (path, size, modification time) of each result in a disk cache folder '''
+    files = []
+    if not os.path.isdir(folder): return files
+    for filename in os.listdir(folder):
+        if filename.endswith('.obj') and not filename.startswith('.'): # Skip files being written
+            filepath = os.path.join(folder, filename)
+            try:
+                stat = os.stat(filepath)
+                files.append((filepath, stat.st_size, stat.st_mtime))
+            except OSError:
+                pass # Deleted by another process in the meantime
+    return files
+
+
+def _evictdiskcache(folder=None, maxbytes=None):
+    ''' Delete the least recently used results until the disk cache folder is no bigger than maxbytes '''
+    files = sorted(_diskcachefiles(folder), key=lambda f: f[2])
+    total = sum([nbytes for filepath,nbytes,mtime in files])
+    for filepath,nbytes,mtime in files:
+        if total <= maxbytes: break
+        try:    os.remove(filepath)
+        except: pass # Deleted by another process in the meantime
+        total -= nbytes
+    return None
+
+
 
 
 ##############################################################################
@@ -229,35 +1398,218 @@ def makefilepath(filename=None, folder=None, ext=None, default=None, split=False
 ### Spreadsheet functions
 ##############################################################################
 
-__all__ += ['Blobject', 'Spreadsheet', 'loadspreadsheet', 'savespreadsheet']
+__all__ += ['Blobject', 'Spreadsheet', 'loadspreadsheet', 'savespreadsheet', 'workbookcache']
+
+
+class WorkbookCache(object):
+    '''
+    An in-process LRU cache of parsed workbooks, keyed by a hash of the blob contents
+    and the parser used (xlrd, openpyxl, or pandas). It is off by default; once enabled,
+    Spreadsheet.xlrd(), openpyxl(), pandas(), and readcells() reuse the parsed book
+    as long as the blob is unchanged. Entries are evicted least-recently-used first
+    once there are more than maxitems of them, or once they use more than maxbytes
+    of memory in total. Each book's size is measured (by walking everything it
+    contains, as in checkmem()) when it's stored, since a parsed book can be tens of
+    times the size of its file; this takes about as long as parsing it again, so if
+    maxbytes is None, books aren't measured and only maxitems applies.
+
+    Note: cached books are shared, so treat them as read-only -- Spreadsheet.edit()
+    always parses a fresh copy.
+
+    Example:
+        sc.workbookcache.enable(maxitems=20, maxbytes=1e9)
+        book = sheet.openpyxl() # Parsed once...
+        book = sheet.openpyxl() # ...then reused
+        print(sc.workbookcache)
+    '''
+
+    def __init__(self, enabled=False, maxitems=10, maxbytes=200e6):
+        self.enabled  = enabled # Whether or not Spreadsheet objects use the cache by default
+        self.maxitems = maxitems # Maximum number of parsed books to keep
+        self.maxbytes = maxbytes # Maximum total memory used by the parsed books
+        self.books    = odict() # The cached books, ordered from least to most recently used
+        self.hits     = 0 # Number of times a cached book was returned
+        self.misses   = 0 # Number of times a book had to be parsed
+        self._lock    = threading.RLock() # Web RPCs may read the same spreadsheet from several threads
+        return None
+
+    def __repr__(self):
+        output = 'Workbook cache (%s): %s books, %s bytes, %s hits, %s misses' % ('enabled' if self.enabled else 'disabled', len(self.books), self.nbytes(), self.hits, self.misses)
+        return output
+
+    @staticmethod
+    def blobhash(blob):
+        ''' The hash used to identify the blob '''
+        return hashlib.sha1(blob).hexdigest()
+
+    def enable(self, maxitems=None, maxbytes=None):
+        ''' Turn the cache on, optionally resetting its limits '''
+        if maxitems is not None: self.maxitems = maxitems
+        if maxbytes is not None: self.maxbytes = maxbytes
+        self.enabled = True
+        self._evict()
+        return None
+
+    def disable(self):
+        ''' Turn the cache off and empty it '''
+        self.enabled = False
+        self.clear()
+        return None
+
+    def nbytes(self):
+        ''' Total memory used by the cached books, as measured when they were stored (0 if maxbytes is None) '''
+        return sum([entry[1] for entry in self.books.values()])
+
+    def get(self, blob=None, parser=None, parsefunc=None):
+        ''' Return the cached book for this blob and parser, calling parsefunc() to create it if needed '''
+        key = (self.blobhash(blob), parser)
+        with self._lock:
+            if key in self.books:
+                self.hits += 1
+                entry = self.books.pop(key) # Pop and reinsert to mark it as most recently used
+                self.books[key] = entry
+                return entry[0]
+        book = parsefunc() # Parse and measure outside the lock, since these are the slow parts
+        nbytes = ut._deepsize(book, set()) if self.maxbytes is not None else 0
+        with self._lock:
+            self.misses += 1
+            self.books[key] = (book, nbytes)
+            self._evict()
+        return book
+
+    def invalidate(self, blob=None):
+        ''' Remove all books parsed from this blob '''
+        if blob is None or not self.books: return None
+        blobhash = self.blobhash(blob)
+        with self._lock:
+            for key in self.books.keys():
+                if key[0] == blobhash:
+                    self.books.pop(key)
+        return None
+
+    def clear(self):
+        ''' Empty the cache and reset the statistics '''
+        with self._lock:
+            self.books.clear()
+            self.hits = 0
+            self.misses = 0
+        return None
+
+    def _evict(self):
+        ''' Remove least recently used books until the cache is within its limits '''
+        with self._lock:
+            while len(self.books) and (len(self.books) > self.maxitems or (self.maxbytes is not None and self.nbytes() > self.maxbytes)):
+                self.books.pop(self.books.keys()[0])
+        return None
+
+
+workbookcache = WorkbookCache() # The cache used by all Spreadsheet objects
+
 
 
 class Blobject(object):
-    ''' A wrapper for a binary file '''
+    '''
+    A wrapper for a binary file.
 
-    def __init__(self, source=None, name=None, filename=None):
+    Small files are stored in memory as bytes; files larger than spoolsize (default
+    50 MB) are spooled to an anonymous temporary file and memory-mapped instead, so
+    that multi-GB payloads don't sit in RAM. In that case, self.blob is a read-only
+    memoryview of the mapped file, and tofile() returns a read-only file object over
+    it rather than a copy. Files are read and written in blocks of blocksize bytes.
+    '''
+
+    spoolsize = 50e6 # Blobs larger than this many bytes are kept in a temporary file rather than in memory
+    blocksize = 2**20 # Size of the blocks used to stream data in and out (1 MB)
+
+    def __init__(self, source=None, name=None, filename=None, spoolsize=None):
         # "source" is a specification of where to get the data from
         # It can be anything supported by Blobject.load() which are
         # - A filename, which will get loaded
-        # - A io.BytesIO which will get dumped into this instance
+        # - A io.BytesIO (or other file object) which will get dumped into this instance
     
         # Handle inputs
         if source   is None and filename is not None: source   = filename # Reset the source to be the filename, e.g. Spreadsheet(filename='foo.xlsx')
         if filename is None and ut.isstring(source):  filename = source   # Reset the filename to be the source, e.g. Spreadsheet('foo.xlsx')
         if name     is None and filename is not None: name     = os.path.basename(filename) # If not supplied, use the filename
+        if spoolsize is not None: self.spoolsize = spoolsize # Otherwise, use the class default
         
         # Define quantities
         self.name      = name # Name of the object
         self.filename  = filename # Filename (used as default for load/save)
         self.created   = ut.now() # When the object was created
         self.modified  = ut.now() # When it was last modified
-        self.blob  = None # The binary data
+        self._blob  = None # The binary data, if stored in memory
+        self._spool = None # The temporary file and memory map, if the binary data is spooled to disk
         self.bytes = None # The filestream representation of the binary data
         if source is not None: self.load(source)
         return None
 
     def __repr__(self):
-        return ut.prepr(self, skip=['blob','bytes'])
+        return ut.prepr(self, skip=['_blob','_spool','bytes'])
+
+    def __getstate__(self):
+        ''' Temporary files and memory maps can't be pickled, so read the data back into memory '''
+        state = self.__dict__.copy()
+        if self._spool is not None:
+            state['_blob'] = bytes(self.blob)
+            state['_spool'] = None
+        state['bytes'] = None # File objects can't be pickled either
+        return state
+
+    def __setstate__(self, state):
+        ''' Handle blobs pickled before spooling was added, and re-spool large blobs '''
+        state = dict(state)
+        blob = state.pop('_blob', state.pop('blob', None))
+        self.__dict__.update(state)
+        self._blob = None
+        self._spool = None
+        self.blob = blob
+        return None
+
+    @property
+    def blob(self):
+        ''' The binary data: bytes if stored in memory, or a read-only memoryview if spooled to disk '''
+        if self._spool is not None:
+            return memoryview(self._spool[1])
+        else:
+            return self._blob
+
+    @blob.setter
+    def blob(self, data):
+        if data is not None and len(data) > self.spoolsize:
+            self._read(io.BytesIO(data)) # Spool it
+        else:
+            self._spool = None
+            self._blob = data
+        return None
+
+    @property
+    def spooled(self):
+        ''' Whether the binary data is currently stored on disk rather than in memory '''
+        return self._spool is not None
+
+    def _read(self, source):
+        '''
+        Read a file object into the blob. Up to spoolsize bytes are read into memory;
+        if there is more than that, everything is streamed to a temporary file in blocks.
+        '''
+        import tempfile
+        import mmap
+        import shutil
+        head = source.read(int(self.spoolsize)+1)
+        if len(head) <= self.spoolsize: # It all fit: store in memory
+            self._spool = None
+            self._blob = head
+        else: # Too big: spool to disk and memory-map it
+            spoolfile = tempfile.TemporaryFile(prefix='sciris_blob_')
+            spoolfile.write(head)
+            del head
+            shutil.copyfileobj(source, spoolfile, self.blocksize)
+            spoolfile.flush()
+            spoolmap = mmap.mmap(spoolfile.fileno(), 0, access=mmap.ACCESS_READ)
+            self._spool = (spoolfile, spoolmap) # Keep both so the file is only removed once the map is gone
+            self._blob = None
+        return None
 
     def load(self, source=None):
         '''
@@ -266,37 +1618,41 @@ class Blobject(object):
         '''
         def read_bin(source):
             ''' Helper to read a binary stream '''
-            source.flush()
+            try:    source.flush()
+            except: pass # Read-only streams can't be flushed
             source.seek(0)
-            output = source.read()
-            return output
+            self._read(source)
+            return None
         
         def read_file(filename):
             ''' Helper to read an actual file '''
             filepath = makefilepath(filename=filename)
             self.filename = filename
             with open(filepath, mode='rb') as f:
-                output = f.read()
-            return output
+                self._read(f)
+            return None
             
+        oldblob = self.blob
         if source is None:
             if self.bytes is not None:
-                self.blob = read_bin(self.bytes)
+                read_bin(self.bytes)
                 self.bytes = None # Once read in, delete
             else:
                 if self.filename is not None:
-                    self.blob = read_file(self.filename)
+                    read_file(self.filename)
                 else:
                     print('Nothing to load: no source or filename supplied and self.bytes is empty.')
         else:
-            if isinstance(source,io.BytesIO):
-                self.blob = read_bin(source)
-            elif ut.isstring(source):
-                self.blob = read_file(source)
+            if ut.isstring(source):
+                read_file(source)
+            elif hasattr(source, 'read') and hasattr(source, 'seek'):
+                read_bin(source)
             else:
-                errormsg = 'Input source must be type string (for a filename) or BytesIO, not %s' % type(source)
+                errormsg = 'Input source must be type string (for a filename) or a file object such as BytesIO, not %s' % type(source)
                 raise Exception(errormsg)
         
+        if workbookcache.enabled and oldblob is not None and oldblob != self.blob:
+            workbookcache.invalidate(oldblob) # Parsed versions of the old blob are now out of date
         self.modified = ut.now()
         return None
 
@@ -313,8 +1669,10 @@ class Blobject(object):
             else:
                 filename = 'spreadsheet.xlsx' # Come up with a terrible default name
         filepath = makefilepath(filename=filename)
+        blob = self.blob
         with open(filepath, mode='wb') as f:
-            f.write(self.blob)
+            for i in range(0, len(blob), self.blocksize): # Write in blocks; slicing memoryviews doesn't copy
+                f.write(blob[i:i+self.blocksize])
         self.filename = filename
         print('Spreadsheet saved to %s.' % filepath)
         return filepath
@@ -325,13 +1683,52 @@ class Blobject(object):
         This can then be used to open the workbook from memory without writing anything to disk e.g.
         - book = openpyxl.load_workbook(self.tofile())
         - book = xlrd.open_workbook(file_contents=self.tofile().read())
+
+        If the blob is spooled to disk, the file object is read-only and reads directly
+        from the memory-mapped file.
         '''
-        bytesblob = io.BytesIO(self.blob)
+        if self._spool is not None:
+            bytesblob = io.BufferedReader(BlobReader(self.blob), buffer_size=self.blocksize)
+        else:
+            bytesblob = io.BytesIO(self.blob)
         if output:
             return bytesblob
         else:
             self.bytes = bytesblob
             return None
+
+
+
+class BlobReader(io.RawIOBase):
+    ''' A read-only file object that reads directly from a buffer, such as a memory-mapped file, without copying it '''
+
+    def __init__(self, buffer=None):
+        self._view = memoryview(buffer)
+        self._pos = 0
+        return None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if   whence == io.SEEK_SET: self._pos = offset
+        elif whence == io.SEEK_CUR: self._pos += offset
+        elif whence == io.SEEK_END: self._pos = len(self._view) + offset
+        else: raise ValueError('Invalid whence (%s)' % whence)
+        self._pos = max(0, self._pos)
+        return self._pos
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view)-self._pos))
+        b[:n] = self._view[self._pos:self._pos+n]
+        self._pos += n
+        return n
     
     
     
@@ -343,28 +1740,38 @@ class Spreadsheet(Blobject):
     Version: 2018sep03
     '''
     
-    def xlrd(self):
+    def _parse(self, parser, parsefunc, cache=None):
+        ''' Parse the blob, using the workbook cache if requested (by default, if it's enabled) '''
+        if cache is None: cache = workbookcache.enabled
+        if cache: book = workbookcache.get(blob=self.blob, parser=parser, parsefunc=parsefunc)
+        else:     book = parsefunc()
+        return book
+    
+    def xlrd(self, cache=None):
         ''' Return a book as opened by xlrd '''
         import xlrd # Optional import
-        book = xlrd.open_workbook(file_contents=self.tofile().read())
+        parsefunc = lambda: xlrd.open_workbook(file_contents=self.tofile().read())
+        book = self._parse('xlrd', parsefunc, cache=cache)
         return book
     
-    def openpyxl(self):
+    def openpyxl(self, cache=None):
         ''' Return a book as opened by openpyxl '''
         import openpyxl # Optional iport
         self.tofile(output=False)
-        book = openpyxl.load_workbook(self.bytes) # This stream can be passed straight to openpyxl
+        parsefunc = lambda: openpyxl.load_workbook(self.bytes) # This stream can be passed straight to openpyxl
+        book = self._parse('openpyxl', parsefunc, cache=cache)
         return book
         
-    def pandas(self):
+    def pandas(self, cache=None):
         ''' Return a book as opened by pandas '''
         import pandas # Optional import
         self.tofile(output=False)
-        book = pandas.ExcelFile(self.bytes)
+        parsefunc = lambda: pandas.ExcelFile(self.bytes)
+        book = self._parse('pandas', parsefunc, cache=cache)
         return book
     
     def update(self, book):
-        self.tofile(output=False)
+        self.bytes = io.BytesIO() # Start from an empty stream, since the new workbook may be shorter than the old one
         book.save(self.bytes)
         self.load()
         return None
@@ -384,12 +1791,12 @@ class Spreadsheet(Blobject):
         else:
             method = None
         if method is None: method = 'xlrd'
-        f = self.tofile()
-        kwargs['fileobj'] = f
+        cache = kwargs.pop('cache', None)
         if method == 'xlrd':
+            kwargs['book'] = self.xlrd(cache=cache)
             output = loadspreadsheet(*args, **kwargs)
         elif method == 'openpyxl':
-            book = self.openpyxl()
+            book = self.openpyxl(cache=cache)
             ws = self._getsheet(book=book, sheetname=kwargs.get('sheetname'), sheetnum=kwargs.get('sheetname'))
             rawdata = tuple(ws.rows)
             output = np.empty(np.shape(rawdata), dtype=object)
@@ -400,19 +1807,55 @@ class Spreadsheet(Blobject):
             errormsg = 'Reading method not found; must be one of xlrd, openpyxl, or pandas, not %s' % method
             raise Exception(errormsg)
         return output
-    
-    def writecells(self, cells=None, row=None, col=None, vals=None, sheetname=None, sheetnum=None, verbose=False):
+
+    def iterrows(self, sheetname=None, sheetnum=None, chunksize=None, header=True, asdataframe=True):
+        '''
+        Iterate over the rows of a sheet using openpyxl's read-only mode, so the
+        workbook is never fully parsed into memory. If chunksize is None, yields
+        one row (a list) at a time; otherwise, yields dataframes of up to chunksize
+        rows (or lists of rows if asdataframe=False). See loadspreadsheet(stream=True).
+
+        Example:
+            for chunk in sheet.iterrows(chunksize=1000):
+                process(chunk)
+        '''
+        return _streamspreadsheet(source=self.tofile(), sheetname=sheetname, sheetnum=sheetnum, chunksize=chunksize, header=header, asdataframe=asdataframe)
+
+    @contextmanager
+    def edit(self, verbose=False):
+        '''
+        Open the workbook once for any number of edits, and save it back to the blob
+        once on exit (changes are discarded if an exception is raised). Use with
+        writecells(wb=wb), or modify the openpyxl workbook directly.
+
+        Example:
+            with sheet.edit() as wb:
+                sheet.writecells(cells='A6', vals='this', wb=wb)
+                sheet.writecells(row=13, col=0, vals=newdata, wb=wb)
+                wb.active['B2'] = 'is a test'
+        '''
+        wb = self.openpyxl(cache=False) # Never edit a cached book
+        if verbose: print('Workbook loaded for editing: %s' % wb)
+        yield wb
+        self.update(wb)
+        if verbose: print('Workbook saved')
+
+    def writecells(self, cells=None, row=None, col=None, vals=None, sheetname=None, sheetnum=None, wb=None, verbose=False):
         '''
         Specify cells to write. Can supply either a list of cells of the same length
         as the values, or else specify a starting row and column and write the values
         from there.
+
+        If an open workbook is supplied as wb (e.g. from edit()), the cells are written
+        to it and the blob is not updated; otherwise, the workbook is loaded and saved
+        on each call.
         '''
-        import openpyxl # Optional import
         
-        # Load workbook
-        self.tofile(output=False) # Convert to bytes
-        wb = openpyxl.load_workbook(self.bytes)
-        if verbose: print('Workbook loaded: %s' % wb)
+        # If no workbook is supplied, open one just for these cells
+        if wb is None:
+            with self.edit(verbose=verbose) as wb:
+                self.writecells(cells=cells, row=row, col=col, vals=vals, sheetname=sheetname, sheetnum=sheetnum, wb=wb, verbose=verbose)
+            return None
         
         # Get right worksheet
         ws = self._getsheet(book=wb, sheetname=sheetname, sheetnum=sheetnum)
@@ -450,26 +1893,41 @@ class Spreadsheet(Blobject):
                         errormsg = 'Could not write "%s" to %s: %s' % (val, key, repr(E))
                         raise Exception(errormsg)
         
-        # Save
-        wb.save(self.bytes)
-        self.load()
-        
         return None
         
     
     pass
     
     
-def loadspreadsheet(filename=None, folder=None, fileobj=None, sheetname=None, sheetnum=None, asdataframe=None, header=True):
+def loadspreadsheet(filename=None, folder=None, fileobj=None, sheetname=None, sheetnum=None, asdataframe=None, header=True, stream=False, chunksize=None, book=None):
     '''
-    Load a spreadsheet as a list of lists or as a dataframe. Read from either a filename or a file object.
+    Load a spreadsheet as a list of lists or as a dataframe. Read from either a filename,
+    a file object, or a book already opened by xlrd.
+
+    If stream=True, the spreadsheet is read lazily with openpyxl in read-only mode,
+    and a generator is returned instead: it yields one row (a list) at a time if
+    chunksize is None, or dataframes of up to chunksize rows otherwise. Memory use
+    is then bounded by the chunk size rather than the size of the workbook.
+
+    Example:
+        for chunk in sc.loadspreadsheet('huge.xlsx', stream=True, chunksize=1000):
+            process(chunk)
     '''
-    import xlrd # Optional import
-    
+
     # Handle inputs
     if asdataframe is None: asdataframe = True
     if isinstance(filename, io.BytesIO): fileobj = filename # It's actually a fileobj
-    if fileobj is None:
+
+    # Optionally stream the rows instead
+    if stream:
+        if fileobj is None: source = makefilepath(filename=filename, folder=folder)
+        else:               source = fileobj
+        return _streamspreadsheet(source=source, sheetname=sheetname, sheetnum=sheetnum, chunksize=chunksize, header=header, asdataframe=asdataframe)
+
+    import xlrd # Optional import
+    if book is not None:
+        pass # Already opened, e.g. by Spreadsheet.xlrd()
+    elif fileobj is None:
         fullpath = makefilepath(filename=filename, folder=folder)
         book = xlrd.open_workbook(fullpath)
     else:
@@ -512,6 +1970,48 @@ def loadspreadsheet(filename=None, folder=None, fileobj=None, sheetname=None, sh
 
 
 
+def _streamspreadsheet(source=None, sheetname=None, sheetnum=None, chunksize=None, header=True, asdataframe=True):
+    ''' Generator used by loadspreadsheet(stream=True) and Spreadsheet.iterrows() -- source is a filename or file object '''
+    import openpyxl # Optional import
+
+    def sanitize(val):
+        ''' Convert values the same way as loadspreadsheet() '''
+        if val is None: return '' # Empty cell, as xlrd would return it
+        try:    return float(val)
+        except:
+            try:    return str(val)
+            except: return val
+
+    book = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        sheet = Spreadsheet._getsheet(book=book, sheetname=sheetname, sheetnum=sheetnum)
+        cols = None
+        chunk = []
+        for r,rowvals in enumerate(sheet.iter_rows(values_only=True)):
+            row = [sanitize(val) for val in rowvals]
+            if r==0:
+                cols = []
+                for c,val in enumerate(row):
+                    if header: attr = str(val)
+                    else:      attr = 'Column %s' % c
+                    cols.append(ut.uniquename(attr, namelist=cols, style='(%d)'))
+                if header: continue # Don't include the header row in the data
+            row = (row + ['']*len(cols))[:len(cols)] # Ensure all rows are the same length
+            if chunksize is None:
+                yield row
+            else:
+                chunk.append(row)
+                if len(chunk) >= chunksize:
+                    yield dataframe(cols=cols, data=chunk) if asdataframe else chunk
+                    chunk = []
+        if chunk: # Yield any leftover rows
+            yield dataframe(cols=cols, data=chunk) if asdataframe else chunk
+    finally:
+        book.close() # Read-only workbooks keep the source open until closed
+    return
+
+
+
 def savespreadsheet(filename=None, data=None, folder=None, sheetnames=None, close=True, formats=None, formatdata=None, verbose=False):
     '''
     Little function to format an output results nicely for Excel. Examples:
@@ -633,6 +2133,37 @@ def savespreadsheet(filename=None, data=None, folder=None, sheetnames=None, clos
 ### Pickling support methods
 ##############################################################################
 
+__all__ += ['remapmodule']
+
+
+_classcache = {} # Classes (and functions, etc.) found while unpickling, keyed by (module name, name)
+_moduleremap = odict() # Old module name -> new module name, for loading files which refer to moved modules
+
+
+def remapmodule(oldname=None, newname=None):
+    '''
+    When loading files, look for anything that was in module oldname (or its submodules)
+    in module newname instead -- e.g. if a module has been renamed or moved since the
+    file was saved. Use newname=None to remove a remapping.
+
+    Example:
+        sc.remapmodule('myproject.oldmodule', 'myproject.newmodule')
+        proj = sc.loadobj('oldproject.prj')
+    '''
+    if newname is None: _moduleremap.pop(oldname, None)
+    else:               _moduleremap[oldname] = newname
+    _classcache.clear() # Anything cached may now be found somewhere else
+    return None
+
+
+def _remapname(module_name=None):
+    ''' Apply the remapping table to a module name '''
+    for oldname,newname in _moduleremap.items():
+        if module_name == oldname or module_name.startswith(oldname+'.'):
+            return newname + module_name[len(oldname):]
+    return module_name
+
+
 class Failed(object):
     ''' An empty class to represent a failed object loading '''
     failure_info = odict()
@@ -648,46 +2179,128 @@ def makefailed(module_name=None, name=None, error=None):
     Failed.failure_info[key]['error'] = repr(error)
     return Failed
 
-class RobustUnpickler(pickle.Unpickler):
+class RemapUnpickler(pickle.Unpickler):
+    ''' An unpickler which caches the classes it finds, and applies the module remapping table (see remapmodule()) '''
+    def find_class(self, module_name, name):
+        key = (module_name, name)
+        cached = _classcache.get(key)
+        if cached is not None and sys.modules.get(cached[0]) is cached[1]: # Check the module hasn't been reloaded
+            return cached[2]
+        new_name = _remapname(module_name)
+        obj = pickle.Unpickler.find_class(self, new_name, name)
+        _classcache[key] = (new_name, sys.modules.get(new_name), obj)
+        return obj
+
+class RobustUnpickler(RemapUnpickler):
     ''' Try to import an object, and if that fails, return a Failed object rather than crashing '''
+    def __init__(self, *args, **kwargs):
+        RemapUnpickler.__init__(self, *args, **kwargs)
+        self.failures = {} # Failed classes are only looked for (and reported) once per load
+        return None
+
     def find_class(self, module_name, name, verbose=False):
+        key = (module_name, name)
+        if key in self.failures:
+            return self.failures[key]
         try:
-            module = __import__(module_name)
-            obj = getattr(module, name)
-        except:
-            try:
-                string = 'from %s import %s as obj' % (module_name, name)
-                exec(string)
-            except Exception as E:
-                if verbose: print('Unpickling warning: could not import %s.%s: %s' % (module_name, name, repr(E)))
-                obj = makefailed(module_name=module_name, name=name, error=E)
+            obj = RemapUnpickler.find_class(self, module_name, name)
+        except Exception as E:
+            if verbose: print('Unpickling warning: could not import %s.%s: %s' % (module_name, name, repr(E)))
+            obj = makefailed(module_name=module_name, name=name, error=E)
+            self.failures[key] = obj
         return obj
 
 def unpickler(string=None, die=None):
+    ''' Unpickle a string, falling back to dill and then RobustUnpickler if needed '''
+    return _unpicklefile(lambda: closing(io.BytesIO(string)), die=die)
+
+def _unpicklefile(openfile=None, die=None, buffers=None, serializer=None):
+    '''
+    Like unpickler(), but read from the file object returned by openfile() -- called
+    again for each attempt. buffers are the out-of-band buffers, if any (protocol 5).
+    If the serializer ('pickle' or 'dill') is known, only that one is tried before
+    falling back to RobustUnpickler. If any modules have been remapped, pickles are
+    loaded with RemapUnpickler, so moved classes are found without an error.
+    '''
     if die is None: die = False
-    try: # Try pickle first
-        obj = pkl.loads(string) # Actually load it -- main usage case
+    kwargs = {'buffers':buffers} if buffers is not None else {}
+    if   serializer == 'dill': loader = _dillload
+    elif len(_moduleremap):    loader = _remapload
+    else:                      loader = pkl.load
+    try: # Try pickle first, unless the file was written by dill
+        with openfile() as fileobj:
+            obj = loader(fileobj, **kwargs) # Actually load it -- main usage case
     except Exception as E:
         if die: 
             raise E
         else:
-            try:    obj = dill.loads(string) # If that fails, try dill
-            except: obj = RobustUnpickler(io.BytesIO(string)).load() # And if that trails, throw everything at it
+            try: # If that fails, try dill, unless that's what has just failed
+                if serializer is not None: raise E
+                with openfile() as fileobj:
+                    obj = _dillload(fileobj, **kwargs)
+            except: # And if that trails, throw everything at it
+                with openfile() as fileobj:
+                    obj = RobustUnpickler(fileobj, **kwargs).load()
     if isinstance(obj, Failed):
         print('Warning, the following errors were encountered during unpickling:')
         print(obj.failure_info)
     return obj
 
-def savepickle(fileobj=None, obj=None):
+def _dillload(fileobj=None, **kwargs):
+    ''' Like pickle.load(), but using dill, which is only imported when needed since it's slow to import '''
+    import dill
+    return dill.load(fileobj, **kwargs)
+
+def _remapload(fileobj=None, **kwargs):
+    ''' Like pickle.load(), but using RemapUnpickler '''
+    return RemapUnpickler(fileobj, **kwargs).load()
+
+def savepickle(fileobj=None, obj=None, protocol=-1, **kwargs):
         ''' Use pickle to do the salty work '''
-        fileobj.write(pkl.dumps(obj, protocol=-1))
+        pkl.dump(obj, fileobj, protocol=protocol, **kwargs)
         return None
       
-def savedill(fileobj=None, obj=None):
+def savedill(fileobj=None, obj=None, protocol=-1, **kwargs):
     ''' Use dill to do the sour work '''
-    fileobj.write(dill.dumps(obj, protocol=-1))
+    import dill # Here to keep "import sciris" fast
+    dill.dump(obj, fileobj, protocol=protocol, **kwargs)
     return None
 
+def savehybrid(fileobj=None, obj=None, protocol=-1, **kwargs):
+    ''' Use pickle to do the salty work, and dill only for the sour bits '''
+    HybridPickler(fileobj, protocol=protocol, **kwargs).dump(obj)
+    return None
+
+class HybridPickler(pickle.Pickler):
+    '''
+    The C pickler, except that functions and classes which can't be pickled by reference
+    (lambdas, closures, and anything defined inside a function) are pickled by value
+    using dill. The result can be loaded with plain pickle, as long as dill is installed.
+    Requires Python 3.8+.
+    '''
+    def __init__(self, fileobj=None, protocol=-1, **kwargs):
+        pickle.Pickler.__init__(self, fileobj, protocol=protocol, **kwargs)
+        self.dillprotocol = protocol
+        return None
+
+    def reducer_override(self, obj):
+        if isinstance(obj, (types.FunctionType, type)) and not _importable(obj):
+            import dill # Here to keep "import sciris" fast
+            return (dill.loads, (dill.dumps(obj, protocol=self.dillprotocol),))
+        return NotImplemented # Otherwise, pickle as usual
+
+def _importable(obj):
+    ''' Check whether a function or class can be pickled by reference, i.e. found again by its module and name '''
+    try:
+        found = sys.modules[obj.__module__]
+        for name in obj.__qualname__.split('.'):
+            found = getattr(found, name)
+        return found is obj
+    except:
+        return False
+
+_serializers = odict([('pickle', savepickle), ('hybrid', savehybrid), ('dill', savedill)]) # In the order they're tried by saveobj()
+
 
 ##############################################################################
 ### Twisted pickling methods
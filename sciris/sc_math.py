@@ -204,7 +204,7 @@ def isprime(n, verbose=False):
 ### OTHER FUNCTIONS
 ##############################################################################
 
-__all__ += ['quantile', 'perturb', 'scaleratio', 'inclusiverange', 'smoothinterp']
+__all__ += ['quantile', 'perturb', 'makerng', 'randstreams', 'scaleratio', 'inclusiverange', 'smoothinterp']
 
 
 def quantile(data, quantiles=[0.5, 0.25, 0.75]):
@@ -225,11 +225,49 @@ def quantile(data, quantiles=[0.5, 0.25, 0.75]):
 
 
 
-def perturb(n=1, span=0.5, randseed=None):
-    ''' Define an array of numbers uniformly perturbed with a mean of 1. n = number of points; span = width of distribution on either side of 1.'''
-    if randseed is not None: np.random.seed(int(randseed)) # Optionally reset random seed
-    output = 1. + 2*span*(np.random.rand(n)-0.5)
+def perturb(n=1, span=0.5, randseed=None, rng=None):
+    '''
+    Define an array of numbers uniformly perturbed with a mean of 1. n = number of points; span = width of distribution on either side of 1.
+    If rng is supplied (a seed or a generator; see makerng()), it's used instead of the global NumPy random state, which randseed resets.
+    '''
+    if rng is not None:
+        output = 1. + 2*span*(makerng(rng).random(n)-0.5)
+    else:
+        if randseed is not None: np.random.seed(int(randseed)) # Optionally reset random seed
+        output = 1. + 2*span*(np.random.rand(n)-0.5)
     return output
+
+
+def makerng(rng=None):
+    '''
+    Return a NumPy random generator (numpy.random.Generator) from a seed, a
+    SeedSequence, or an existing generator (which is returned as is). None gives an
+    unpredictable generator. Unlike np.random.seed(), this doesn't affect anything else.
+
+    Example:
+        rng = sc.makerng(42)
+        x = rng.random(10)
+    '''
+    if isinstance(rng, np.random.Generator):
+        return rng
+    return np.random.default_rng(rng)
+
+
+def randstreams(seed=None, n=1):
+    '''
+    Return a list of n independent random generators, all derived from one seed using
+    SeedSequence.spawn(). Generator i is always the same for a given seed, no matter
+    how many are made, so giving each task its own (e.g. task i gets generator i) makes
+    results reproducible however the tasks are split between threads or processes.
+    parallelize(..., seed=) does this automatically.
+
+    Example:
+        rngs = sc.randstreams(seed=42, n=100)
+        results = [runmodel(rng=rng) for rng in rngs]
+    '''
+    if isinstance(seed, np.random.SeedSequence): seedseq = seed
+    else:                                        seedseq = np.random.SeedSequence(seed)
+    return [np.random.default_rng(child) for child in seedseq.spawn(n)]
     
     
     
@@ -0,0 +1,228 @@
+"""
+parallel.py -- functions for running things in parallel
+"""
+
+##############################################################################
+### Imports
+##############################################################################
+
+import pickle
+import traceback
+import multiprocessing as mp
+import numpy as np
+from . import sc_utils as ut
+
+
+
+
+##############################################################################
+### Parallelization functions
+##############################################################################
+
+__all__ = ['parallelize']
+
+
+def parallelize(func=None, iterarg=None, kwargs=None, ncpus=None, maxload=None, interval=None, chunksize=None, shared=None, seed=None, die=True, verbose=False):
+    '''
+    Run func(arg, **kwargs) for each arg in iterarg, on a pool of ncpus processes
+    (default: one per CPU), and return the results as a list in the same order as
+    iterarg. If iterarg is an integer, it's used as range(iterarg).
+
+    func and kwargs are pickled with dill, so func can be a lambda or closure; the
+    items of iterarg (and the results) are pickled as usual. The items are sent to
+    the workers in chunks of chunksize (by default, enough for about 4 chunks per
+    process). At most ncpus chunks are running at once, and if maxload is given,
+    each new chunk is only started once the CPU load is below it (see loadbalancer();
+    interval is how often to check, in seconds).
+
+    If a task raises an exception, an exception is raised with the task's traceback,
+    unless die=False, in which case the result for that task is the exception.
+
+    Large arrays in kwargs can be put in shared memory (see SharedArray) rather than
+    copied to every process: shared is a list of the names of the kwargs to share, or
+    True to share all NumPy arrays in kwargs. The workers get read-only arrays which
+    use the same memory, which is freed once parallelize() finishes (or fails).
+
+    If seed is given, each task gets its own random generator, passed to func as the
+    "rng" keyword argument: task i always gets the same one (see randstreams()), so
+    the results don't depend on ncpus, chunksize, or which process ran which task.
+
+    Examples:
+        results = sc.parallelize(runmodel, [1,2,3,4], kwargs={'years':50})
+        squares = sc.parallelize(lambda x: x**2, 100, ncpus=4, maxload=0.8)
+        results = sc.parallelize(runmodel, seeds, kwargs={'inputs':biginputs}, shared=['inputs'])
+        samples = sc.parallelize(lambda n, rng: rng.normal(size=n), [10]*100, seed=42)
+    '''
+    import dill # Here to keep "import sciris" fast
+    
+    # Handle inputs
+    if kwargs is None: kwargs = {}
+    if ut.isnumber(iterarg): iterarg = range(int(iterarg))
+    iterarg = list(iterarg)
+    ntasks = len(iterarg)
+    if ncpus is None: ncpus = mp.cpu_count()
+    ncpus = max(1, min(int(ncpus), ntasks))
+    if chunksize is None: chunksize = max(1, int(np.ceil(ntasks/(4.0*ncpus))))
+    if interval is None: interval = 1.0
+    if seed is None: seeds = [None]*ntasks
+    else:            seeds = np.random.SeedSequence(seed).spawn(ntasks) # One independent stream per task
+    indexed = [(index, arg, seeds[index]) for index,arg in enumerate(iterarg)]
+    chunks = [indexed[i:i+chunksize] for i in range(0, ntasks, chunksize)]
+    if not chunks: return []
+    
+    # Put any shared arrays in shared memory, and make sure they're freed at the end
+    if shared is True: shared = [key for key,val in kwargs.items() if isinstance(val, np.ndarray) and val.dtype != object]
+    sharedarrays = []
+    try:
+        kwargs = dict(kwargs)
+        for key in ut.promotetolist(shared):
+            sharedarrays.append(SharedArray(kwargs[key]))
+            kwargs[key] = sharedarrays[-1]
+        taskstring = dill.dumps((func, kwargs)) # Pickled once, and sent to (and unpickled in) each process once, when it starts
+        results = _runchunks(taskstring, chunks, ncpus=ncpus, maxload=maxload, interval=interval, iterarg=iterarg, die=die, verbose=verbose)
+    finally:
+        for sharedarray in sharedarrays:
+            sharedarray.close()
+    return results
+
+
+def _runchunks(taskstring=None, chunks=None, ncpus=None, maxload=None, interval=None, iterarg=None, die=True, verbose=False):
+    ''' Do the work of parallelize() '''
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED # Python 3 only
+    ntasks = len(iterarg)
+
+    # Run the chunks, keeping at most ncpus running at once
+    results = [None]*ntasks
+    ndone = 0
+    with ProcessPoolExecutor(max_workers=ncpus, initializer=_initworker, initargs=(taskstring,)) as pool:
+        pending = set()
+        nextchunk = 0
+        while nextchunk < len(chunks) or pending:
+            while nextchunk < len(chunks) and len(pending) < ncpus: # Start new chunks
+                if maxload is not None:
+                    ut.loadbalancer(maxload=maxload, index=0, interval=interval, verbose=verbose)
+                pending.add(pool.submit(_runchunk, chunks[nextchunk]))
+                nextchunk += 1
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunkresults = pickle.loads(future.result())
+                ndone += len(chunkresults)
+                for index,result,tbstring in chunkresults:
+                    if tbstring is not None and die:
+                        for otherfuture in pending: otherfuture.cancel()
+                        errormsg = 'Task %i of %i (argument %s) failed:\n%s' % (index+1, ntasks, ut.flexstr(iterarg[index]), tbstring)
+                        raise Exception(errormsg)
+                    results[index] = result
+            if verbose: print('Parallelize: %i of %i tasks complete' % (ndone, ntasks))
+    return results
+
+
+_task = None # The unpickled function and kwargs in each worker process
+_attached = {} # Shared memory blocks attached to in each worker process, by name
+
+
+def _initworker(taskstring=None):
+    ''' Unpickle the function and kwargs, once, when a worker process starts '''
+    global _task
+    import dill
+    _task = dill.loads(taskstring)
+    return None
+
+
+def _runchunk(chunk=None):
+    '''
+    Run the function on each (index, arg, seed) entry in the chunk, in a worker process;
+    return a pickled list of (index, result, traceback), one per entry. Results that
+    can't be pickled are replaced by an exception, as if the task had failed, so one
+    bad result doesn't lose the whole chunk.
+    '''
+    func, kwargs = _task
+    output = []
+    for index,arg,seedseq in chunk:
+        try:
+            if seedseq is None: result = func(arg, **kwargs)
+            else:               result = func(arg, rng=np.random.default_rng(seedseq), **kwargs)
+            output.append((index, result, None))
+        except Exception as E:
+            try:    pickle.dumps(E)
+            except: E = Exception(repr(E)) # Make sure it can be sent back
+            output.append((index, E, traceback.format_exc()))
+    try:
+        return pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception: # Find the results that can't be sent back
+        for i,(index,result,tbstring) in enumerate(output):
+            try:
+                pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception as E:
+                output[i] = (index, Exception('Result could not be pickled: %s' % repr(E)), traceback.format_exc())
+        return pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+
+##############################################################################
+### Shared memory
+##############################################################################
+
+__all__ += ['SharedArray']
+
+
+class SharedArray(object):
+    '''
+    A copy of a NumPy array in shared memory (Python 3.8+), for sending to other
+    processes without copying: when pickled, only the name of the memory block, the
+    shape, and the dtype are sent, and it is unpickled as a read-only NumPy array
+    which uses the same memory. The memory is freed by close(), or at the end of a
+    "with" block. parallelize(..., shared=...) does all this automatically.
+
+    Example:
+        with sc.SharedArray(biginputs) as inputs:
+            with ProcessPoolExecutor() as pool:
+                results = list(pool.map(runmodel, [inputs]*32))
+    '''
+
+    def __init__(self, arr=None):
+        from multiprocessing import shared_memory # Python 3.8+
+        arr = np.asarray(arr)
+        if arr.dtype == object:
+            errormsg = 'Only arrays of numbers (or other fixed-size types) can be shared, not arrays of objects'
+            raise Exception(errormsg)
+        self.shape = arr.shape
+        self.dtype = arr.dtype
+        self.shm   = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes)) # Size can't be 0
+        self.name  = self.shm.name
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf) # This process's view of it
+        self.array[...] = arr
+        return None
+
+    def __repr__(self):
+        return 'SharedArray "%s": %s %s' % (self.name, self.shape, self.dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return None
+
+    def __reduce__(self):
+        return (_attachshared, (self.name, self.shape, self.dtype))
+
+    def close(self):
+        ''' Free the shared memory; arrays using it in other processes remain valid until those processes are done with them '''
+        if self.shm is not None:
+            self.array = None
+            try:    self.shm.close()
+            except: pass # Something else is still using it in this process; it's freed when that's deleted
+            self.shm.unlink()
+            self.shm = None
+        return None
+
+
+def _attachshared(name=None, shape=None, dtype=None):
+    ''' Unpickle a SharedArray: return a read-only array using its shared memory '''
+    from multiprocessing import shared_memory
+    if name not in _attached:
+        _attached[name] = shared_memory.SharedMemory(name=name) # Kept open until the process exits
+    arr = np.ndarray(shape, dtype=dtype, buffer=_attached[name].buf)
+    arr.flags.writeable = False
+    return arr
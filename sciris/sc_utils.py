@@ -9,26 +9,25 @@ import uuid as py_uuid
 import copy
 import time
 import datetime
-import dateutil
+import threading
+import functools
+import hashlib
+import struct
 import pprint
 from textwrap import fill
 from functools import reduce
-from psutil import cpu_percent
 from subprocess import Popen, PIPE
 from collections import OrderedDict as OD
 
 # Handle types and Python 2/3 compatibility
 from six import PY2 as _PY2
+from six.moves import copyreg
 from numbers import Number as _numtype
-if _PY2: 
-    _stringtype = basestring 
-    from cPickle import dump
-else:   
-    _stringtype = str
-    from pickle import dump
+if _PY2: _stringtype = basestring 
+else:    _stringtype = str
 
 # Define the modules being loaded
-__all__ = ['uuid', 'dcp']
+__all__ = ['uuid', 'dcp', 'hashobj']
 
 
 def uuid(uid=None, which=None, die=False, as_string=False):
@@ -60,12 +59,372 @@ def uuid(uid=None, which=None, die=False, as_string=False):
     return output
 
 
-def dcp(obj=None):
-    ''' Shortcut to perform a deep copy operation '''
-    output = copy.deepcopy(obj)
+def dcp(obj=None, fast=True, cow=False, cowsize=1e6):
+    '''
+    Shortcut to perform a deep copy operation. By default, this is much faster than
+    copy.deepcopy() for typical Sciris objects: NumPy arrays are copied in one go,
+    lists, dicts, odicts, and plain objects (e.g. projects and dataframes) are copied
+    directly, and immutable objects are not copied at all. Anything with its own copy
+    or pickling methods is copied by copy.deepcopy() as usual; use fast=False to use
+    copy.deepcopy() for everything.
+
+    With cow=True ("copy on write"), NumPy arrays of at least cowsize bytes are not
+    copied, but shared as read-only views: this saves time and memory when the large
+    arrays are only read, e.g. cloning a scenario whose inputs won't change. Writing
+    to a shared array raises an error, so copy it first (e.g. arr = arr.copy()) if it
+    needs to change; note that changes to the original array are seen by the copy.
+
+    Examples:
+        newproject = sc.dcp(project)
+        newscen = sc.dcp(scen, cow=True)
+    '''
+    if not fast:
+        return copy.deepcopy(obj)
+    output = _fastcopy(obj, {}, cowsize if cow else None)
+    return output
+
+
+_immutabletypes = set([type(None), bool, int, float, complex, bytes, str, range, type, type(len), type(dcp), type(os), type(Ellipsis), type(NotImplemented)]) # Never need to be copied
+
+
+def _fastcopy(obj=None, memo=None, cowsize=None):
+    ''' The recursive part of dcp(); memo is the same as for copy.deepcopy(), which it falls back on '''
+    objtype = type(obj)
+    if objtype in _immutabletypes:
+        return obj
+    objid = id(obj)
+    if objid in memo: # Already copied, or being copied
+        return memo[objid]
+    copier = _copiers.get(objtype)
+    if copier is None: # Work out how to copy this type, once
+        copier = _copiers[objtype] = _getcopier(objtype)
+    return copier(obj, objid, memo, cowsize)
+
+
+def _copylist(obj, objid, memo, cowsize):
+    output = []
+    memo[objid] = output
+    output.extend([_fastcopy(item, memo, cowsize) for item in obj])
+    return output
+
+
+def _copydict(obj, objid, memo, cowsize):
+    output = {}
+    memo[objid] = output
+    for key,val in obj.items():
+        output[key] = _fastcopy(val, memo, cowsize)
     return output
 
 
+def _copytuple(obj, objid, memo, cowsize):
+    items = [_fastcopy(item, memo, cowsize) for item in obj]
+    if objid in memo: return memo[objid] # Copied while copying the items, i.e. it contains itself
+    output = obj if all([new is old for new,old in zip(items, obj)]) else tuple(items) # Like deepcopy(), don't copy a tuple of immutables
+    memo[objid] = output
+    return output
+
+
+def _copyarray(obj, objid, memo, cowsize):
+    if obj.dtype == object: # Copy each element
+        output = np.empty(obj.shape, dtype=object)
+        memo[objid] = output
+        flat = output.reshape(-1) # A view, since it's new
+        for i,item in enumerate(obj.flat):
+            flat[i] = _fastcopy(item, memo, cowsize)
+    elif cowsize is not None and obj.nbytes >= cowsize: # Share it
+        output = obj.view()
+        output.flags.writeable = False
+    else:
+        output = obj.copy()
+    memo[objid] = output
+    return output
+
+
+def _copyodict(obj, objid, memo, cowsize):
+    objtype = type(obj)
+    output = objtype.__new__(objtype)
+    OD.__init__(output)
+    memo[objid] = output
+    for key,val in OD.items(obj):
+        OD.__setitem__(output, key, _fastcopy(val, memo, cowsize)) # Bypass odict.__setitem__(), which is slow
+    attrs = object.__getattribute__(obj, '__dict__') # Bypass odict.__getattribute__(), which is also slow
+    if attrs:
+        output.__dict__.update(_fastcopy(attrs, memo, cowsize))
+    return output
+
+
+def _copyobject(obj, objid, memo, cowsize):
+    objtype = type(obj)
+    output = objtype.__new__(objtype)
+    memo[objid] = output
+    output.__dict__.update(_fastcopy(obj.__dict__, memo, cowsize))
+    return output
+
+
+def _copyimmutable(obj, objid, memo, cowsize):
+    return obj
+
+
+def _copydeep(obj, objid, memo, cowsize):
+    return copy.deepcopy(obj, memo)
+
+
+def _getcopier(objtype=None):
+    ''' Choose how to copy objects of this type '''
+    if issubclass(objtype, np.generic): # NumPy scalars
+        return _copyimmutable
+    elif issubclass(objtype, np.ndarray) and objtype.__deepcopy__ is np.ndarray.__deepcopy__:
+        return _copyarray
+    elif issubclass(objtype, OD) and _plaincopy(objtype, OD): # Including odicts
+        return _copyodict
+    elif getattr(objtype, '__dictoffset__', 0) and _userclass(objtype) and _plaincopy(objtype, object): # Instances have a __dict__, which holds everything
+        return _copyobject
+    else: # Anything else, e.g. sets, subclasses of list, or objects with custom copying
+        return _copydeep
+
+
+_heaptypeflag = 1<<9 # Py_TPFLAGS_HEAPTYPE: set for classes defined in Python, not for builtins like list and dict
+
+def _userclass(objtype=None):
+    ''' Whether objtype, and every class it inherits from except object, is defined in Python -- if it extends a builtin (e.g. a list), its contents aren't in its __dict__ '''
+    return all([base.__flags__ & _heaptypeflag for base in objtype.__mro__[:-1]])
+
+
+def _plaincopy(objtype=None, base=None):
+    ''' Whether objects of this type can be copied just by copying their attributes (and items), i.e. don't customize copying or pickling '''
+    if objtype in copyreg.dispatch_table or hasattr(objtype, '__deepcopy__') or hasattr(objtype, '__setstate__') or hasattr(objtype, '__slots__'):
+        return False
+    for method in ['__reduce_ex__', '__reduce__', '__getstate__', '__getnewargs__', '__getnewargs_ex__']:
+        if getattr(objtype, method, None) is not getattr(base, method, None):
+            return False
+    return True
+
+
+_copiers = {list:_copylist, dict:_copydict, tuple:_copytuple} # How to copy each type, filled in as they're seen
+
+
+def hashobj(obj=None, algorithm='blake2b'):
+    '''
+    Return a hash of an object's contents, as a hex string, which is the same for
+    objects which are the same -- in any session -- and changes if anything in the
+    object changes. Much faster than hashing dumpstr(obj), since nothing is pickled or
+    compressed: lists, dicts, odicts, and plain objects (e.g. projects and dataframes)
+    are walked, and the data of NumPy arrays are hashed directly. Objects with their
+    own pickling methods (e.g. Blobjects) are hashed by what they would pickle. The
+    order of the keys matters for odicts but not for dicts (or attributes).
+
+    algorithm is any algorithm in hashlib (e.g. 'sha256'), or, if the xxhash package
+    is installed, 'xxh64', 'xxh3_64', or 'xxh3_128', which are faster still.
+
+    Examples:
+        if sc.hashobj(project) != lastsaved:
+            sc.saveobj('project.prj', project)
+            lastsaved = sc.hashobj(project)
+    '''
+    if algorithm.startswith('xxh'):
+        try:
+            import xxhash
+        except ImportError as E:
+            errormsg = 'The xxhash package is needed for algorithm "%s": %s' % (algorithm, repr(E))
+            raise Exception(errormsg)
+        newhash = getattr(xxhash, algorithm)
+    elif algorithm == 'blake2b':
+        newhash = hashlib.blake2b # Faster than going via hashlib.new()
+    else:
+        newhash = lambda: hashlib.new(algorithm)
+    hasher = _ObjHasher(newhash)
+    hasher.add(obj)
+    return hasher.hash.hexdigest()
+
+
+class _ObjHasher(object):
+    ''' Feed an object, and everything it contains, into a hash; hashobj() does the rest '''
+
+    def __init__(self, newhash=None):
+        self.newhash = newhash
+        self.hash    = newhash()
+        self.update  = self.hash.update
+        self.memo    = {} # Position of each container already hashed, so cycles and shared objects are only hashed once
+        self.keep    = [] # Keep temporary objects alive, so their ids aren't reused
+        return None
+
+    def add(self, obj):
+        ''' Add an object to the hash '''
+        objtype = type(obj)
+        adder = _hashers.get(objtype)
+        if adder is None: # Work out how to hash this type, once
+            adder = _hashers[objtype] = _gethasher(objtype)
+        adder(self, obj)
+        return None
+
+    def seen(self, obj):
+        ''' Check whether a container has already been hashed, and if so, add a reference to it instead '''
+        objid = id(obj)
+        if objid in self.memo:
+            self.update(b'r%d;' % self.memo[objid])
+            return True
+        self.memo[objid] = len(self.memo)
+        self.keep.append(obj)
+        return False
+
+    def digest(self, obj):
+        ''' Hash an object separately, e.g. to put dict keys in a consistent order '''
+        hasher = _ObjHasher(self.newhash)
+        hasher.add(obj)
+        return hasher.hash.digest()
+
+
+def _hashnone(hasher, obj):
+    hasher.update(b'N')
+
+def _hashbool(hasher, obj):
+    hasher.update(b'T' if obj else b'F')
+
+def _hashint(hasher, obj):
+    hasher.update(b'i%d;' % obj)
+
+def _hashfloat(hasher, obj):
+    hasher.update(b'f' + struct.pack('<d', obj))
+
+def _hashcomplex(hasher, obj):
+    hasher.update(b'c' + struct.pack('<dd', obj.real, obj.imag))
+
+def _hashstr(hasher, obj):
+    _hashbytes(hasher, obj.encode('utf-8', 'surrogatepass'), tag=b's')
+
+def _hashbytes(hasher, obj, tag=b'b'):
+    hasher.update(tag + b'%d;' % len(obj))
+    hasher.update(obj)
+
+def _hashbuffer(hasher, obj):
+    _hashbytes(hasher, memoryview(obj).cast('B')) # E.g. memoryviews and memory maps, without copying
+
+def _hashsequence(hasher, obj):
+    if hasher.seen(obj): return
+    hasher.update(b'l' + type(obj).__name__.encode() + b'%d;' % len(obj))
+    for item in obj:
+        hasher.add(item)
+
+def _hashdict(hasher, obj, ordered=False):
+    if hasher.seen(obj): return
+    hasher.update(b'd' + type(obj).__name__.encode() + b'%d;' % len(obj))
+    items = list(OD.items(obj) if isinstance(obj, OD) else dict.items(obj)) # Bypass odict.items(), which is slow
+    if not ordered:
+        try:    items.sort(key=lambda item: item[0]) # Usually the keys are all strings
+        except: items.sort(key=lambda item: hasher.digest(item[0])) # Otherwise, sort by their hashes
+    for key,val in items:
+        hasher.add(key)
+        hasher.add(val)
+
+def _hashodict(hasher, obj):
+    _hashdict(hasher, obj, ordered=True)
+    attrs = object.__getattribute__(obj, '__dict__') # Bypass odict.__getattribute__(), which is slow
+    if attrs: _hashdict(hasher, attrs)
+
+def _hashset(hasher, obj):
+    if hasher.seen(obj): return
+    hasher.update(b'e' + type(obj).__name__.encode() + b'%d;' % len(obj))
+    for digest in sorted([hasher.digest(item) for item in obj]):
+        hasher.update(digest)
+
+def _hasharray(hasher, obj):
+    if hasher.seen(obj): return
+    hasher.update(b'a' + repr((obj.dtype.descr, obj.shape)).encode())
+    if obj.dtype == object:
+        for item in obj.flat:
+            hasher.add(item)
+    else:
+        arr = np.ascontiguousarray(obj).reshape(-1).view(np.uint8) # Only copies if the array isn't contiguous
+        hasher.update(arr)
+
+def _hashnpscalar(hasher, obj):
+    hasher.update(b'g' + repr(obj.dtype.descr).encode() + obj.tobytes())
+
+def _hashname(hasher, obj):
+    name = '%s.%s' % (getattr(obj, '__module__', None), getattr(obj, '__qualname__', getattr(obj, '__name__', None)))
+    _hashbytes(hasher, name.encode(), tag=b'n')
+
+def _hashfunction(hasher, obj):
+    ''' Hash a function by its name, code, defaults, and the values of the variables it closes over (but not the globals it uses) '''
+    if hasher.seen(obj): return # E.g. a recursive closure
+    _hashname(hasher, obj)
+    hasher.add(obj.__code__)
+    hasher.add(obj.__defaults__)
+    hasher.add(obj.__kwdefaults__)
+    for cell in obj.__closure__ or []:
+        try:    hasher.add(cell.cell_contents)
+        except ValueError: hasher.update(b'E') # Empty cell, e.g. a variable assigned later
+
+def _hashcode(hasher, obj):
+    ''' Hash a code object by its bytecode, constants (including the code of nested functions), and the names it uses '''
+    _hashbytes(hasher, obj.co_code, tag=b'k')
+    hasher.add(obj.co_consts)
+    hasher.add(obj.co_names)
+
+def _hashcontainer(hasher, obj):
+    ''' Hash a subclass of a builtin container by its contents, then any attributes '''
+    if   isinstance(obj, (list, tuple)): _hashsequence(hasher, obj)
+    elif isinstance(obj, dict):          _hashdict(hasher, obj, ordered=isinstance(obj, OD))
+    else:                                _hashset(hasher, obj)
+    attrs = getattr(obj, '__dict__', None)
+    if attrs: _hashdict(hasher, attrs)
+
+def _hashobject(hasher, obj):
+    if hasher.seen(obj): return
+    hasher.update(b'o')
+    _hashname(hasher, type(obj))
+    _hashdict(hasher, obj.__dict__)
+
+def _hashreduce(hasher, obj):
+    ''' Hash anything else by what it would pickle '''
+    if hasher.seen(obj): return
+    try:
+        parts = obj.__reduce_ex__(4)
+    except Exception as E:
+        errormsg = 'Could not hash object of type %s: %s' % (type(obj), repr(E))
+        raise Exception(errormsg)
+    hasher.update(b'p')
+    _hashname(hasher, type(obj))
+    if isinstance(parts, _stringtype): # A global
+        hasher.add(parts)
+        return
+    parts = list(parts)
+    for i in [3,4]: # Iterators of list items and dict items
+        if len(parts) > i and parts[i] is not None:
+            parts[i] = list(parts[i])
+    hasher.keep.append(parts)
+    for part in parts[1:]: # Skip the function which recreates it, since the type has been added
+        hasher.add(part)
+
+
+def _gethasher(objtype=None):
+    ''' Choose how to hash objects of this type '''
+    import types
+    import mmap
+    if issubclass(objtype, types.FunctionType):
+        return _hashfunction
+    elif issubclass(objtype, types.CodeType):
+        return _hashcode
+    elif issubclass(objtype, (type, types.BuiltinFunctionType, types.ModuleType)):
+        return _hashname
+    elif issubclass(objtype, np.generic):
+        return _hashnpscalar
+    elif issubclass(objtype, (memoryview, mmap.mmap)):
+        return _hashbuffer
+    elif issubclass(objtype, OD) and _plaincopy(objtype, OD): # Including odicts
+        return _hashodict
+    elif issubclass(objtype, (list, tuple, dict, set, frozenset)): # E.g. subclasses of list, whose contents aren't in their __dict__
+        return _hashcontainer
+    elif getattr(objtype, '__dictoffset__', 0) and _userclass(objtype) and _plaincopy(objtype, object): # Instances have a __dict__, which holds everything
+        return _hashobject
+    else: # Anything else, e.g. objects with custom pickling
+        return _hashreduce
+
+
+_hashers = {type(None):_hashnone, bool:_hashbool, int:_hashint, float:_hashfloat, complex:_hashcomplex, str:_hashstr, bytes:_hashbytes, bytearray:_hashbytes,
+            list:_hashsequence, tuple:_hashsequence, dict:_hashdict, set:_hashset, frozenset:_hashset, np.ndarray:_hasharray} # How to hash each type, filled in as they're seen
+
+
 def pp(obj):
     ''' Shortcut for pretty-printing the object '''
     pprint.pprint(obj)
@@ -798,11 +1157,12 @@ def promotetolist(obj=None, objtype=None, keepnone=False):
 ### MISC. FUNCTIONS
 ##############################################################################
 
-__all__ += ['now', 'tic', 'toc', 'percentcomplete', 'checkmem', 'loadbalancer', 'runcommand', 'gitinfo', 'compareversions', 'uniquename', 'importbyname']
+__all__ += ['now', 'tic', 'toc', 'Timer', 'Timers', 'timer', 'timers', 'memoize', 'percentcomplete', 'checkmem', 'loadbalancer', 'runcommand', 'gitinfo', 'compareversions', 'uniquename', 'importbyname']
 
 def now(timezone='utc', die=False, tostring=False, fmt=None):
     ''' Get the current time, in UTC time '''
-    if timezone=='utc':                           tzinfo = dateutil.tz.tzutc()
+    from dateutil import tz # Here to keep "import sciris" fast
+    if timezone=='utc':                           tzinfo = tz.tzutc()
     elif timezone is None or timezone=='current': tzinfo = None
     else:                                         raise Exception('Timezone "%s" not understood' % timezone)
     timenow = datetime.datetime.now(tzinfo)
@@ -858,6 +1218,288 @@ def toc(start=None, output=False, label=None, sigfigs=None, filename=None):
     
 
 
+class Timers(object):
+    '''
+    A registry of named timers, which add up the time spent in each labeled piece of
+    code: the number of calls, and the total, mean, and maximum time. Timers can be
+    nested, in which case the inner one is recorded under e.g. 'outer/inner'; each
+    thread keeps its own nesting, and the totals are shared. A timer started while
+    one with the same label is already running (e.g. in a recursive function) isn't
+    recorded separately, since its time is included in the outer one's. Uses time.perf_counter(),
+    and costs a few microseconds per call, so can be left in production code (or
+    turned off with timers.enabled = False). Usually used via sc.timer() and
+    sc.timers, rather than directly.
+
+    Example:
+        with sc.timer('run'):
+            for i in range(10):
+                with sc.timer('step'):
+                    model.step()
+
+        @sc.timer('save')
+        def save(project): ...
+
+        sc.timers.report() # Print a table of the results
+        df = sc.timers.report(asdataframe=True)
+    '''
+
+    def __init__(self):
+        self.enabled = True
+        self.stats   = OD() # [count, total, max] for each label, in order of first use
+        self.lock    = threading.Lock()
+        self._local  = threading.local() # Stack of running timers for each thread
+        return None
+
+    def __repr__(self):
+        return 'Timers: %i labels (%s)' % (len(self.stats), 'enabled' if self.enabled else 'disabled')
+
+    def __getitem__(self, label):
+        ''' Return the count, total, mean, and max time for a label '''
+        count, total, maxtime = self.stats[label]
+        return OD([('count', count), ('total', total), ('mean', total/count), ('max', maxtime)])
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def start(self, label=None):
+        ''' Start a timer; it is nested inside any timer already running on this thread '''
+        stack = self._stack()
+        label = str(label)
+        parent = stack[-1][0] if stack else None # Path of the innermost recorded timer
+        if not self.enabled or (parent is not None and label in parent.split('/')): # Disabled, or already running
+            path, record = parent, False # Placeholder, so stop() still matches
+        else:
+            path, record = (parent + '/' + label if parent is not None else label), True
+        stack.append((path, record, time.perf_counter())) # Get the time last, so it isn't included
+        return None
+
+    def stop(self):
+        ''' Stop the innermost running timer, record it, and return the elapsed time '''
+        end = time.perf_counter()
+        path, record, start = self._stack().pop()
+        elapsed = end - start
+        if record:
+            with self.lock:
+                stats = self.stats.get(path)
+                if stats is None:
+                    self.stats[path] = [1, elapsed, elapsed]
+                else:
+                    stats[0] += 1
+                    stats[1] += elapsed
+                    if elapsed > stats[2]: stats[2] = elapsed
+        return elapsed
+
+    def timer(self, label=None):
+        ''' Return a Timer using this registry '''
+        return Timer(label=label, timers=self)
+
+    def reset(self):
+        ''' Clear all results '''
+        with self.lock:
+            self.stats.clear()
+        return None
+
+    def report(self, asdataframe=False, output=False, sigfigs=None):
+        ''' Print a table of the results, or return them as an ordered dict (output=True) or a dataframe (asdataframe=True) '''
+        if sigfigs is None: sigfigs = 3
+        with self.lock:
+            rows = [[path, count, total, total/count, maxtime] for path,(count,total,maxtime) in self.stats.items()]
+        
+        # Put each timer after the one it's nested in (which finishes, and so is recorded, after it)
+        order = {row[0]:r for r,row in enumerate(rows)}
+        def sortkey(row):
+            parts = row[0].split('/')
+            return [order.get('/'.join(parts[:i+1]), len(order)) for i in range(len(parts))]
+        rows.sort(key=sortkey)
+        if asdataframe:
+            from .sc_dataframe import dataframe # Here to avoid a circular import
+            return dataframe(cols=['label', 'count', 'total', 'mean', 'max'], data=rows)
+        elif output:
+            return OD([(row[0], self[row[0]]) for row in rows])
+        else:
+            labels = ['  '*path.count('/') + path.split('/')[-1] for path,count,total,mean,maxtime in rows]
+            width = max([len('Label')] + [len(label) for label in labels])
+            print('%s  %8s  %10s  %10s  %10s' % ('Label'.ljust(width), 'Count', 'Total (s)', 'Mean (s)', 'Max (s)'))
+            for label,(path,count,total,mean,maxtime) in zip(labels, rows):
+                print('%s  %8i  %10s  %10s  %10s' % (label.ljust(width), count, sigfig(total, sigfigs), sigfig(mean, sigfigs), sigfig(maxtime, sigfigs)))
+            return None
+
+
+class Timer(object):
+    ''' A named timer, for use as a context manager or decorator; see timer() '''
+
+    def __init__(self, label=None, timers=None):
+        self.label  = label
+        self.timers = timers if timers is not None else globals()['timers']
+        return None
+
+    def __repr__(self):
+        return 'Timer "%s"' % self.label
+
+    def __enter__(self):
+        self.timers.start(self.label)
+        return self
+
+    def __exit__(self, *args):
+        self.timers.stop()
+        return None
+
+    def __call__(self, func):
+        ''' Use as a decorator; with no label, the function's name is used '''
+        label = self.label if self.label is not None else getattr(func, '__qualname__', func.__name__)
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.timers.start(label)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.timers.stop()
+        return wrapper
+
+
+def timer(label=None):
+    '''
+    Time a block of code (as a context manager) or a function (as a decorator), adding
+    the results to sc.timers (see Timers). Used as a decorator without a label, the
+    function's name is used.
+
+    Examples:
+        with sc.timer('load'):
+            data = sc.loadobj('data.obj')
+
+        @sc.timer
+        def run(): ...
+    '''
+    if callable(label): # Used as @timer rather than @timer('label')
+        return Timer()(label)
+    return Timer(label)
+
+
+timers = Timers() # The default registry
+
+
+def memoize(func=None, maxsize=128, maxbytes=None, ttl=None):
+    '''
+    Cache the results of a function, so calling it again with the same arguments
+    returns the stored result instead of recomputing it. Like functools.lru_cache(),
+    but the arguments can be NumPy arrays, odicts, lists, and other unhashable objects,
+    which are compared by value. When the cache holds more than maxsize results, or
+    (if maxbytes is given) their estimated total size in memory is more than maxbytes,
+    the least recently used results are dropped. Results older than ttl seconds are
+    recomputed. The function should return the same thing for the same arguments, and
+    the results shouldn't be modified, since the cached copy is what's returned. Safe
+    to use from multiple threads.
+
+    The decorated function has cache_info(), which returns the number of hits,
+    misses, and evictions and the current size, and cache_clear().
+
+    Examples:
+        @sc.memoize
+        def interpolate(x, y, newx): ...
+
+        @sc.memoize(maxsize=None, maxbytes=100e6, ttl=3600)
+        def loadcolormap(name): ...
+
+        interpolate.cache_info()
+    '''
+    if func is None: # Used as @memoize(...) rather than @memoize
+        return lambda func: memoize(func, maxsize=maxsize, maxbytes=maxbytes, ttl=ttl)
+
+    cache = OD() # Key: [result, nbytes, expiry time], least recently used first
+    stats = OD([('hits', 0), ('misses', 0), ('evictions', 0), ('size', 0), ('nbytes', 0), ('maxsize', maxsize), ('maxbytes', maxbytes)])
+    lock = threading.RLock() # Reentrant, since hashing the arguments could call this function
+    missing = object()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = _cachekey((args, kwargs))
+        with lock:
+            entry = cache.get(key, missing)
+            if entry is not missing and (entry[2] is None or entry[2] > time.time()):
+                cache.move_to_end(key)
+                stats['hits'] += 1
+                return entry[0]
+            stats['misses'] += 1
+        
+        # Compute the result, without holding the lock, and store it
+        result = func(*args, **kwargs)
+        nbytes = _deepsize(result, set()) if maxbytes is not None else 0
+        if maxbytes is not None and nbytes > maxbytes:
+            return result # It would push everything else out
+        expiry = time.time() + ttl if ttl is not None else None
+        with lock:
+            old = cache.pop(key, None) # Expired, or stored by another thread in the meantime
+            if old is not None: stats['nbytes'] -= old[1]
+            cache[key] = [result, nbytes, expiry]
+            stats['nbytes'] += nbytes
+            while (maxsize is not None and len(cache) > maxsize) or (maxbytes is not None and stats['nbytes'] > maxbytes):
+                oldkey, old = cache.popitem(last=False)
+                stats['nbytes'] -= old[1]
+                stats['evictions'] += 1
+            stats['size'] = len(cache)
+        return result
+
+    def cache_info():
+        ''' Return the cache statistics '''
+        with lock:
+            stats['size'] = len(cache)
+            return OD(stats)
+
+    def cache_clear():
+        ''' Empty the cache and reset the statistics '''
+        with lock:
+            cache.clear()
+            for key in ['hits', 'misses', 'evictions', 'size', 'nbytes']: stats[key] = 0
+        return None
+
+    wrapper.cache_info  = cache_info
+    wrapper.cache_clear = cache_clear
+    return wrapper
+
+
+_hashabletypes = (type(None), bool, int, float, complex, str, bytes)
+
+def _cachekey(obj=None):
+    '''
+    Turn a function argument into something hashable, which is equal for equal
+    arguments. Arrays, unhashable objects, and objects which are only equal to
+    themselves (e.g. dataframes and prettyobjs, which can be changed in place) are
+    represented by hashobj(), and containers by the keys of their contents (tagged
+    with their type).
+    '''
+    objtype = type(obj)
+    if objtype in _hashabletypes:
+        return obj
+    elif isinstance(obj, np.ndarray):
+        return ('ndarray', hashobj(obj))
+    elif isinstance(obj, np.generic):
+        return ('npscalar', obj.dtype.str, obj.item())
+    elif isinstance(obj, (list, tuple)):
+        return (objtype.__name__, tuple([_cachekey(item) for item in obj]))
+    elif isinstance(obj, dict):
+        items = [(_cachekey(key), _cachekey(val)) for key,val in obj.items()]
+        if not isinstance(obj, OD): # The order doesn't matter
+            items.sort(key=lambda item: repr(item[0]))
+        return (objtype.__name__, tuple(items))
+    elif isinstance(obj, (set, frozenset)):
+        return (objtype.__name__, tuple(sorted([_cachekey(item) for item in obj], key=repr)))
+    elif objtype.__eq__ is object.__eq__: # Compared by identity, so use the contents instead
+        try:
+            return (objtype.__name__, hashobj(obj))
+        except Exception:
+            return obj # e.g. a lock, which can only be compared by identity anyway
+    try:
+        hash(obj)
+        return obj # Use the object's own hash and equality
+    except TypeError:
+        return (objtype.__name__, hashobj(obj))
+
+
+
 def percentcomplete(step=None, maxsteps=None, indent=1):
     ''' Display progress '''
     onepercent = max(1,round(maxsteps/100)); # Calculate how big a single step is -- not smaller than 1
@@ -868,71 +1510,177 @@ def percentcomplete(step=None, maxsteps=None, indent=1):
 
 
 
-def checkmem(origvariable, descend=0, order='n', plot=False, verbose=0):
+def checkmem(origvariable=None, descend=0, order='n', plot=False, verbose=0, output=False, asdataframe=False):
     '''
-    Checks how much memory the variable in question uses by dumping it to file.
-    
+    Checks how much memory the variable (origvariable) uses, by walking through everything
+    it contains and adding up their sizes (using sys.getsizeof(), which includes the
+    data of NumPy arrays). Objects referred to more than once are only counted once,
+    in the first place they're found.
+
+    descend is the number of levels to break the total down by: e.g. with descend=1,
+    the size of each item of a list, each key of a dict or odict, each column of a
+    dataframe, or each attribute of an object (such as a project) is also shown;
+    with descend=2, the items within those too. Each level is sorted by size (largest
+    first), or alphabetically if order='a'.
+
+    With output=True, return an ordered dict of the sizes in bytes, keyed by the path to each
+    item (e.g. 'results.main'), rather than printing them; asdataframe=True returns
+    them as a dataframe.
+
     Example:
         from utils import checkmem
         checkmem(['spiffy',rand(2483,589)],descend=1)
+        checkmem(project, descend=2, asdataframe=True)
     '''
-    filename = os.getcwd()+'/checkmem.tmp'
-    
-    def dumpfile(variable):
-        wfid = open(filename,'wb')
-        dump(variable, wfid)
-        return None
-    
-    printnames = []
-    printbytes = []
-    printsizes = []
-    varnames = []
-    variables = []
-    if descend==False or not(np.iterable(origvariable)):
-        varnames = ['']
-        variables = [origvariable]
-    elif descend==1 and np.iterable(origvariable):
-        if hasattr(origvariable,'keys'):
-            for key in origvariable.keys():
-                varnames.append(key)
-                variables.append(origvariable[key])
-        else:
-            varnames = range(len(origvariable))
-            variables = origvariable
-    
-    for v,variable in enumerate(variables):
-        if verbose: print('Processing variable %i of %i' % (v+1, len(variables)))
-        dumpfile(variable)
-        filesize = os.path.getsize(filename)
-        factor = 1
-        label = 'B'
-        labels = ['KB','MB','GB']
-        for i,f in enumerate([3,6,9]):
-            if filesize>10**f:
-                factor = 10**f
-                label = labels[i]
-        printnames.append(varnames[v])
-        printbytes.append(filesize)
-        printsizes.append('%0.3f %s' % (float(filesize/float(factor)), label))
-        os.remove(filename)
-
-    if order=='a' or order=='alpha' or order=='alphabetical':
-        inds = np.argsort(printnames)
-    else:
-        inds = np.argsort(printbytes)
-
-    for v in inds:
-        print('Variable %s is %s' % (printnames[v], printsizes[v]))
-
+    # Measure everything, to the requested depth
+    seen = set() # IDs of the objects already counted
+    rows = [] # Path, depth, and size of each item
+    def measure(obj, path, depth):
+        if depth >= descend:
+            nbytes = _deepsize(obj, seen)
+            rows.append([path, depth, nbytes])
+            return nbytes
+        row = [path, depth, 0]
+        rows.append(row)
+        if verbose: print('Processing %s' % (path if path else 'variable'))
+        nbytes, parts = _memparts(obj, seen)
+        for name,part in parts:
+            nbytes += measure(part, _mempath(path, obj, name), depth+1)
+        row[2] = nbytes
+        return nbytes
+    measure(origvariable, '', 0)
+    
+    # Sort each level, keeping children with their parents
+    def sortkey(row): return row[0] if order in ['a', 'alpha', 'alphabetical'] else -row[2]
+    def sortrows(rows):
+        if not rows: return []
+        depth = rows[0][1]
+        groups = []
+        for row in rows:
+            if row[1] == depth: groups.append([row, []])
+            else:               groups[-1][1].append(row)
+        groups.sort(key=lambda group: sortkey(group[0]))
+        return [row for parent,children in groups for row in [parent]+sortrows(children)]
+    rows = rows[:1] + sortrows(rows[1:])
+    
+    # Plot the top-level breakdown
     if plot==True:
         try:    
             from pylab import pie, array, axes
         except Exception as E: 
             raise Exception('Cannot plot since import failed: %s' % repr(E))
+        plotrows = [row for row in rows if row[1]==1] or rows[:1]
         axes(aspect=1)
-        pie(array(printbytes)[inds], labels=array(printnames)[inds], autopct='%0.2f')
+        pie(array([row[2] for row in plotrows]), labels=[row[0] for row in plotrows], autopct='%0.2f')
+    
+    # Output
+    if asdataframe:
+        from .sc_dataframe import dataframe # Here to avoid a circular import
+        return dataframe(cols=['variable', 'depth', 'bytes', 'size'], data=[[row[0], row[1], row[2], _memlabel(row[2])] for row in rows])
+    elif output:
+        return OD([(row[0], row[2]) for row in rows])
+    else:
+        for path,depth,nbytes in rows:
+            print('%s%s is %s' % ('  '*depth, 'Variable %s' % path if path else 'Total', _memlabel(nbytes)))
+        return None
 
-    return None
+
+class _memgroup(list):
+    ''' A group of objects which checkmem() measures together, but which takes up no memory of its own -- e.g. a dataframe column '''
+    pass
+
+
+def _memparts(obj=None, seen=None):
+    '''
+    Return the memory used by obj itself (excluding the objects it contains), and a
+    list of (name, object) pairs for the objects it contains. The internal parts of obj
+    (such as an object's __dict__) are marked as seen.
+    '''
+    import mmap
+    import types
+    
+    # Handle objects which are only counted once, and don't take up memory of their own
+    if isinstance(obj, _memgroup):
+        return 0, list(enumerate(obj))
+    if id(obj) in seen:
+        return 0, []
+    seen.add(id(obj))
+    
+    # Things which aren't part of the object's data, or which shouldn't be looked inside
+    if isinstance(obj, (type, types.ModuleType)):
+        return 0, []
+    if isinstance(obj, (_stringtype, bytes, _numtype, types.FunctionType, types.BuiltinFunctionType)) or obj is None:
+        return sys.getsizeof(obj), []
+    if isinstance(obj, mmap.mmap): # e.g. a spooled Blobject: count the mapped data
+        return sys.getsizeof(obj) + len(obj), []
+    
+    # Handle containers
+    nbytes = sys.getsizeof(obj)
+    if isinstance(obj, np.ndarray): # Includes the data, if the array owns it
+        parts = [('base', obj.base)] if obj.base is not None else []
+        if obj.dtype == object:
+            parts += [(i, item) for i,item in enumerate(obj.flat)]
+        return nbytes, parts
+    if isinstance(obj, memoryview):
+        return nbytes, [('obj', obj.obj)]
+    if isinstance(obj, dict): # Including odicts
+        for key in obj.keys():
+            if id(key) not in seen:
+                seen.add(id(key))
+                nbytes += sys.getsizeof(key)
+        return nbytes, list(obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return nbytes, list(enumerate(obj))
+    
+    # Handle dataframes, by column
+    if isinstance(getattr(obj, 'data', None), np.ndarray) and isinstance(getattr(obj, 'cols', None), list) and obj.data.ndim == 2:
+        for internal in [obj.__dict__, obj.cols, obj.data, getattr(obj, 'shape', None)] + obj.cols:
+            if internal is not None and id(internal) not in seen:
+                seen.add(id(internal))
+                nbytes += sys.getsizeof(internal)
+        return nbytes, [(col, _memgroup(obj.data[:,c].tolist())) for c,col in enumerate(obj.cols)]
+    
+    # Handle other objects, by attribute
+    parts = []
+    if isinstance(getattr(obj, '__dict__', None), dict) and id(obj.__dict__) not in seen:
+        seen.add(id(obj.__dict__))
+        nbytes += sys.getsizeof(obj.__dict__)
+        parts += list(obj.__dict__.items())
+    for attr in getattr(type(obj), '__slots__', []):
+        if isinstance(attr, _stringtype) and hasattr(obj, attr):
+            parts.append((attr, getattr(obj, attr)))
+    return nbytes, parts
+
+
+def _deepsize(obj=None, seen=None):
+    ''' Add up the memory used by obj and everything it contains, skipping anything already seen '''
+    nbytes = 0
+    stack = [obj]
+    while stack:
+        thisbytes, parts = _memparts(stack.pop(), seen)
+        nbytes += thisbytes
+        stack.extend([part for name,part in parts])
+    return nbytes
+
+
+def _mempath(path=None, obj=None, name=None):
+    ''' The path to an item within obj, e.g. 'results.main' or 'runs[3]' '''
+    if isinstance(obj, (list, tuple, set, frozenset, np.ndarray, _memgroup)): item = '[%s]' % name
+    elif path:                                                                 item = '.%s' % flexstr(name)
+    else:                                                                      item = flexstr(name)
+    return path + item
+
+
+def _memlabel(nbytes=None):
+    ''' Format a number of bytes, e.g. '3.142 MB' '''
+    factor = 1
+    label = 'B'
+    labels = ['KB','MB','GB']
+    for i,f in enumerate([3,6,9]):
+        if nbytes>10**f:
+            factor = 10**f
+            label = labels[i]
+    return '%0.3f %s' % (float(nbytes/float(factor)), label)
 
 
 
@@ -954,6 +1702,8 @@ def loadbalancer(maxload=None, index=None, interval=None, maxtime=None, label=No
 
     Version: 2017oct25
      '''
+    import psutil # Here to keep "import sciris" fast
+    
     # Set up processes to start asynchronously
     if maxload  is None: maxload = 0.8
     if interval is None: interval = 5.0
@@ -974,7 +1724,7 @@ def loadbalancer(maxload=None, index=None, interval=None, maxtime=None, label=No
     maxcount = maxtime/float(interval)
     while toohigh and count<maxcount:
         count += 1
-        currentload = cpu_percent(interval=0.1)/100. # If interval is too small, can give very inaccurate readings
+        currentload = psutil.cpu_percent(interval=0.1)/100. # If interval is too small, can give very inaccurate readings
         if currentload>maxload:
             if verbose: print(label+'CPU load too high (%0.2f/%0.2f); process %s queued %i times' % (currentload, maxload, index, count))
             time.sleep(interval*2*np.random.rand()) # Sleeps for an average of refresh seconds, but do it randomly so you don't get locking
@@ -0,0 +1,50 @@
+"""
+Benchmark sc.dcp() against copy.deepcopy() on a project-like object.
+"""
+
+import copy
+import numpy as np
+import sciris as sc
+
+# Define a project-like object: an odict of scenarios, each with parameters,
+# data, and results
+class Result(object):
+    def __init__(self, name, npts):
+        self.name = name
+        self.t = np.arange(npts)
+        self.vals = np.random.rand(10, npts)
+        self.summary = sc.odict([('Mean', self.vals.mean()), ('Max', self.vals.max())])
+
+class Scenario(object):
+    def __init__(self, name, npars=200, npts=500):
+        self.name = name
+        self.uid = sc.uuid()
+        self.pars = sc.odict([('par%i' % i, sc.odict(value=np.random.rand(), limits=[0, 1], label='Parameter %i' % i)) for i in range(npars)])
+        self.data = sc.dataframe(cols=['year', 'value', 'source'], data=[[2000+i, np.random.rand(), 'Survey'] for i in range(50)])
+        self.inputs = np.random.rand(1000, 1000) # A large, read-only array
+        self.results = [Result('Result %i' % i, npts) for i in range(20)]
+
+project = sc.odict([('Scenario %i' % i, Scenario('Scenario %i' % i)) for i in range(10)])
+
+# Check the copies are the same
+for copied in [sc.dcp(project), sc.dcp(project, cow=True)]:
+    assert copied.keys() == project.keys()
+    assert (copied[3].inputs == project[3].inputs).all()
+    assert copied[3].pars['par5']['value'] == project[3].pars['par5']['value']
+    assert copied[3].data['value'][7] == project[3].data['value'][7]
+    assert copied[3].results[4].summary['Max'] == project[3].results[4].summary['Max']
+    assert copied[3].results[4].vals is not project[3].results[4].vals
+
+# Time them
+timings = sc.odict()
+for label,func in [('copy.deepcopy()',  lambda: copy.deepcopy(project)),
+                   ('sc.dcp()',         lambda: sc.dcp(project)),
+                   ('sc.dcp(cow=True)', lambda: sc.dcp(project, cow=True))]:
+    start = sc.tic()
+    for i in range(3): func()
+    timings[label] = sc.toc(start, output=True)/3
+
+for label,elapsed in timings.items():
+    print('%-20s %0.3f s (%0.1fx)' % (label, elapsed, timings[0]/elapsed))
+
+print('Done.')
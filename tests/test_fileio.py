@@ -13,6 +13,18 @@ torun = [
 #'loadspreadsheet',
 #'Blobject',
 'Spreadsheet',
+'iterrows',
+'workbookcache',
+'spooled',
+'codecs',
+'outofband',
+'serializer',
+'remapmodule',
+'background',
+'loadobjs',
+'archive',
+'objectstore',
+'diskcache',
 #'saveobj',
 #'loadobj',
 #'savetext',
@@ -48,7 +60,7 @@ if check('savespreadsheet', ['loadspreadsheet', 'Spreadsheet']):
         'big':   {'bg_color':'#ffcccc'}}
     formatdata = pl.zeros((nrows+1, ncols), dtype=object) # Format data needs to be the same size
     formatdata[1:,:] = 'plain' # Format data
-    formatdata[testdata>0.7] = 'big' # Find "big" numbers and format them differently
+    formatdata[1:,:][testdata[1:,:].astype(float)>0.7] = 'big' # Find "big" numbers (skipping the header row) and format them differently
     formatdata[0,:] = 'header' # Format header
     sc.savespreadsheet(filename=files.excel, data=testdata, formats=formats, formatdata=formatdata)
 
@@ -79,12 +91,50 @@ if check('Spreadsheet'):
     S.writecells(cells=['A6','B7','C8','D9','E10'], vals=['this','is','a','test','!']) # Method 1
     newdata = (pl.rand(3,3)*100).round()
     S.writecells(row=13, col=0, vals=newdata, verbose=True) # Method 2
+    with S.edit() as wb: # Method 3 -- many writes, one save
+        for r in range(3):
+            S.writecells(row=17+r, col=0, vals=newdata[r], wb=wb)
+        wb.active['F1'] = 'Edited'
     S.save()
-    data = S.readcells(header=False)
+    data = S.readcells(method='openpyxl', header=False) # xlrd 2 only reads .xls files
     print(S)
     sc.pp(data)
     
 
+# Test streaming spreadsheet rows
+if check('iterrows'):
+    S = sc.Spreadsheet(files.excel)
+    rows = list(S.iterrows(header=False))
+    assert len(rows) == len(S.readcells(method='openpyxl', header=False)) # Including the rows written by the Spreadsheet test
+    chunks = list(S.iterrows(chunksize=4))
+    assert all([isinstance(chunk, sc.dataframe) for chunk in chunks]) and sum([chunk.nrows() for chunk in chunks]) == len(rows)-1 # Less the header row
+    for chunk in sc.loadspreadsheet(files.excel, stream=True, chunksize=4):
+        print(chunk)
+
+
+# Test the parsed-workbook cache
+if check('workbookcache'):
+    sc.workbookcache.enable()
+    S = sc.Spreadsheet(files.excel)
+    assert S.openpyxl() is S.openpyxl() # Parsed only once
+    S.writecells(cells='A2', vals='Changed')
+    assert S.readcells(method='openpyxl', header=False)[1][0] == 'Changed' # Cache invalidated by the write
+    assert sc.workbookcache.nbytes() > len(S.blob) # Measures the parsed books, not the blobs
+    sc.workbookcache.enable(maxbytes=sc.workbookcache.nbytes()//2)
+    assert len(sc.workbookcache.books) == 0 # Too big to keep
+    print(sc.workbookcache)
+    sc.workbookcache.disable()
+
+
+# Test spooling large blobs to disk
+if check('spooled'):
+    S = sc.Spreadsheet(files.excel, spoolsize=1000) # Tiny threshold to force spooling
+    assert S.spooled
+    S.writecells(cells='A2', vals='Spooled')
+    assert S.readcells(method='openpyxl', header=False)[1][0] == 'Spooled'
+    assert sc.dcp(S).blob == S.blob
+
+
 if check('saveobj', ['loadobj']):
     sc.saveobj(files.binary, testdata)
 
@@ -94,6 +144,115 @@ if check('loadobj'):
     print(obj)
 
 
+if check('codecs'):
+    for codec in ['gzip', 'bz2', 'lzma', 'none']:
+        sc.saveobj(files.binary, testdata, codec=codec)
+        obj = sc.loadobj(files.binary) # Codec is detected automatically
+        assert (obj == testdata).all()
+        assert (sc.loadstr(sc.dumpstr(testdata, codec=codec)) == testdata).all()
+        sc.saveobj(files.binary, testdata, codec=codec, nthreads=4) # Block-parallel compression
+        assert (sc.loadobj(files.binary) == testdata).all()
+
+
+if check('outofband'):
+    arrays = sc.odict(a=pl.rand(1000), b=pl.rand(30,40).T)
+    sc.saveobj(files.binary, arrays, outofband=True)
+    for mmap in [False, True]:
+        obj = sc.loadobj(files.binary, mmap=mmap)
+        assert (obj['a'] == arrays['a']).all() and (obj['b'] == arrays['b']).all()
+
+
+if check('serializer'):
+    lambdadata = sc.odict(data=testdata, func=lambda x: x+1) # Can't be pickled, so the hybrid pickler is used
+    for method in ['pickle', 'auto', 'hybrid', 'dill']: # 'auto' skips straight to the hybrid pickler
+        sc.saveobj(files.binary, lambdadata, method=method)
+        obj = sc.loadobj(files.binary, die=True) # The serializer is read from the header
+        assert obj['func'](1) == 2
+
+
+if check('remapmodule'):
+    import pickle
+    string = pickle.dumps(sc.odict(a=1), protocol=2).replace(b'sciris.sc_odict', b'sciris.sc_oldodict') # As if the module had been renamed
+    sc.remapmodule('sciris.sc_oldodict', 'sciris.sc_odict')
+    assert sc.sc_fileio.unpickler(string, die=True)['a'] == 1
+    sc.remapmodule('sciris.sc_oldodict')
+
+
+if check('background'):
+    future = sc.saveobj(files.binary, testdata, background=True) # Returns straight away
+    assert sc.savequeue.wait() == 0 # Wait for all saves to finish
+    assert (sc.loadobj(future.result()) == testdata).all()
+    sc.saveobj(files.binary, {'version':1, 'data':pl.rand(500000)}, codec='lzma', background=True) # Slow
+    sc.saveobj(files.binary, {'version':2}, background=True) # Fast, but must not be overwritten by the slow one
+    sc.savequeue.wait()
+    assert sc.loadobj(files.binary)['version'] == 2
+
+
+if check('loadobjs'):
+    batchfiles = ['test%i.obj' % i for i in range(3)]
+    sc.saveobjs({filename:testdata for filename in batchfiles}, nthreads=2)
+    objs = sc.loadobjs(batchfiles+['missing.obj'], nthreads=2) # Errors are returned, not raised
+    assert objs.keys() == batchfiles+['missing.obj'] and isinstance(objs['missing.obj'], Exception)
+    for filename in batchfiles: os.remove(filename)
+
+
+if check('archive'):
+    scens = sc.odict([('Scenario %i' % i, testdata) for i in range(5)])
+    sc.savearchive(files.binary, scens)
+    archive = sc.loadarchive(files.binary)
+    assert (archive['Scenario 3'] == testdata).all() and not archive.isloaded('Scenario 4') # Only what's accessed is loaded
+    archive.update('Scenario 4', 'Updated') # Only this entry is written
+    assert sc.loadarchive(files.binary)['Scenario 4'] == 'Updated'
+
+
+if check('objectstore'):
+    import shutil
+    store = sc.ObjectStore('teststore')
+    arrays = sc.odict(a=pl.rand(300000), b=pl.rand(300000))
+    store.save('arrays', arrays)
+    arrays['b'][0] = 0 # Change one chunk
+    assert store.save('arrays', arrays) < store.chunksize # Only the changed chunks are written
+    assert (store.load('arrays')['b'] == arrays['b']).all()
+    open(os.path.join('teststore', 'manifests', '.arrays.12345678.tmp'), 'w').close() # As left by a save that was killed
+    assert store.keys() == ['arrays']
+    assert store.gc() == 0 # The old chunks were only just written, so they might be part of a save in progress
+    assert store.gc(minage=0) > 0 # Remove the old chunks
+    shutil.rmtree('teststore')
+
+
+if check('diskcache'):
+    import shutil
+    calls = []
+    @sc.diskcache(folder='testcache', maxbytes=3e6)
+    def slowsum(arr, opts=None):
+        calls.append(arr)
+        return pl.zeros(100000) + arr.sum()
+    arr = pl.rand(1000)
+    assert (slowsum(arr) == slowsum(arr.copy())).all() and len(calls) == 1 # Second call loaded from disk
+    slowsum(arr, opts=sc.odict(a=1))
+    assert slowsum.cache_info()['nfiles'] == 2
+    for i in range(5): slowsum(pl.rand(10))
+    assert slowsum.cache_info()['nbytes'] <= 3e6 # Old results were deleted
+    slowsum.cache_clear()
+    assert slowsum.cache_info()['nfiles'] == 0
+    
+    class Values(list): pass # Subclasses of builtins are keyed by their contents, not just their attributes
+    @sc.diskcache(folder='testcache')
+    def total(values): return sum(values)
+    assert total(Values([1])) == 1 and total(Values([2])) == 2
+    assert total(x for x in [1,2]) == 3 # Generators can't be hashed, so aren't cached
+    
+    @sc.diskcache(folder='testcache')
+    def apply(func, x): return func(x)
+    assert apply(lambda x: x+1, 10) == 11 and apply(lambda x: x+2, 10) == 12 # Functions as arguments
+    def make(k):
+        @sc.diskcache(folder='testcache')
+        def scale(x): return x*k
+        return scale
+    assert make(2)(10) == 20 and make(3)(10) == 30 # The decorated function's closure
+    shutil.rmtree('testcache')
+
+
 if check('savetext', ['loadtext']):
     sc.savetext(files.text, testdata)
 
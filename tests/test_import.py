@@ -0,0 +1,38 @@
+"""
+Version:
+"""
+
+import sys
+import subprocess
+
+torun = [
+'importtime',
+'lazy',
+]
+
+budget = 0.5 # Maximum time in seconds for "import sciris", including NumPy; importing Matplotlib alone takes longer than this
+heavy = ['matplotlib', 'pylab', 'dill', 'psutil', 'pandas', 'openpyxl', 'xlrd'] # Modules which shouldn't be imported until they're used
+
+def runcode(code):
+    ''' Run code in a new Python process, so nothing has been imported yet, and return what it prints '''
+    return subprocess.check_output([sys.executable, '-c', code]).decode().strip()
+
+
+if 'importtime' in torun:
+    code = 'import time; start = time.perf_counter(); import sciris; print(time.perf_counter() - start)'
+    elapsed = min([float(runcode(code)) for i in range(3)]) # Best of 3, to allow for a cold disk cache
+    print('"import sciris" took %0.3f s (budget %0.3f s)' % (elapsed, budget))
+    assert elapsed < budget, 'Importing Sciris took %0.3f s, more than the budget of %0.3f s' % (elapsed, budget)
+    imported = runcode('import sys, sciris; print(",".join([name for name in %r if name in sys.modules]))' % heavy)
+    assert not imported, 'These modules should not be imported by "import sciris": %s' % imported
+
+
+if 'lazy' in torun:
+    import sciris as sc
+    from sciris import sc_plotting
+    assert sorted(sc._lazynames) == sorted(sc_plotting.__all__) # The list in __init__.py is up to date
+    assert sc.gridcolors is sc_plotting.gridcolors
+    assert 'boxoff' in dir(sc) and 'boxoff' in sc.__all__
+
+
+print('Done.')
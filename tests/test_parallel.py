@@ -0,0 +1,52 @@
+"""
+Version:
+"""
+
+import numpy as np
+import sciris as sc
+
+torun = [
+'parallelize',
+'shared',
+'seed',
+]
+
+
+def lookup(i, data=None):
+    assert not data.flags.owndata # A view of the shared memory, not a copy
+    return data[i]
+
+
+def square(x, offset=0):
+    if x < 0: raise ValueError('Negative input')
+    return x**2 + offset
+
+
+def noisy(x, rng=None):
+    return x + rng.random()
+
+
+if __name__ == '__main__': # Required for multiprocessing on Windows
+
+    if 'parallelize' in torun:
+        assert sc.parallelize(square, 10, kwargs={'offset':1}, ncpus=2) == [x**2+1 for x in range(10)] # Results are in order
+        factor = 3
+        assert sc.parallelize(lambda x: factor*x, [1,2,3]) == [3,6,9] # Closures are pickled with dill
+        results = sc.parallelize(square, [1,-1,2], die=False)
+        assert results[0] == 1 and isinstance(results[1], Exception) and results[2] == 4
+        results = sc.parallelize(lambda x: (lambda: x) if x < 0 else x, [1,-1,2], die=False) # A closure can't be sent back
+        assert results[0] == 1 and isinstance(results[1], Exception) and results[2] == 2
+
+    if 'shared' in torun:
+        data = np.random.rand(100000)
+        assert sc.parallelize(lookup, 5, kwargs={'data':data}, shared=['data']) == list(data[:5])
+
+    if 'seed' in torun:
+        results = sc.parallelize(noisy, 20, seed=1, ncpus=1)
+        assert results == sc.parallelize(noisy, 20, seed=1, ncpus=2, chunksize=3) # Same however the tasks are split up
+        assert results != sc.parallelize(noisy, 20, seed=2)
+        rngs = sc.randstreams(seed=1, n=20)
+        assert results[7] == 7 + rngs[7].random()
+        assert (sc.perturb(5, rng=3) == sc.perturb(5, rng=3)).all()
+
+    print('Done.')
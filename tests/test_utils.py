@@ -1,3 +1,207 @@
+"""
+Version:
+"""
+
+import numpy as np
+import sciris as sc
+
+torun = [
+'checkmem',
+'dcp',
+'timers',
+'memoize',
+'hashobj',
+]
+
+
+class List(list): pass # Subclasses of builtins, whose contents aren't in their __dict__
+class Dict(dict): pass
+
+
+if 'checkmem' in torun:
+    arr = np.zeros(100000) # 800 kB
+    project = sc.prettyobj()
+    project.results = sc.odict(main=arr, copy=arr) # The same array twice, so only counted once
+    project.data = sc.dataframe(cols=['x','y'], data=[[1,'a'],[2,'b']])
+    project.name = 'Project'
+    sizes = sc.checkmem(project, descend=2, output=True)
+    assert arr.nbytes < sizes[''] < 2*arr.nbytes
+    assert sizes['results'] > arr.nbytes and sizes['results.main'] > arr.nbytes and sizes['results.copy'] < 1000
+    assert list(sizes.keys())[1] == 'results' # Largest first
+    assert 'data.x' in sizes # Dataframes are broken down by column
+    df = sc.checkmem(origvariable=project, descend=1, asdataframe=True, order='a') # The original argument name still works
+    assert list(df['variable']) == ['', 'data', 'name', 'results'] and list(df['depth']) == [0, 1, 1, 1]
+    sc.checkmem(['spiffy', np.random.rand(2483,589)], descend=1)
+
+
+if 'dcp' in torun:
+    project = sc.prettyobj()
+    project.pars = sc.odict(a=np.arange(5), b=[1, {'c':2}])
+    project.pars['self'] = project.pars # Cycles are kept
+    project.items = List([1, 2, 3])
+    project.items.label = 'Items'
+    project.dict = Dict(a=1)
+    project.inputs = np.random.rand(1000, 1000)
+    copied = sc.dcp(project)
+    assert copied.pars['b'] == project.pars['b'] and copied.pars['b'] is not project.pars['b']
+    assert copied.pars['self'] is copied.pars
+    assert isinstance(copied.items, List) and copied.items == [1, 2, 3] and copied.items.label == 'Items'
+    assert isinstance(copied.dict, Dict) and copied.dict == {'a':1}
+    assert sc.dcp(List([1,2,3])) == [1,2,3] and sc.dcp(Dict(a=1)) == {'a':1}
+    copied.pars['a'][0] = 10
+    assert project.pars['a'][0] == 0
+    shared = sc.dcp(project, cow=True) # Large arrays are shared, read-only
+    assert np.shares_memory(shared.inputs, project.inputs) and not shared.inputs.flags.writeable
+    assert not np.shares_memory(shared.pars['a'], project.pars['a'])
+
+
+if 'timers' in torun:
+    import threading
+    timers = sc.Timers() # Separate from sc.timers, so nothing else is included
+    
+    @timers.timer()
+    def step(): pass # Recorded under its name
+    
+    @timers.timer('rec')
+    def rec(n): return rec(n-1) if n else 0 # Only the outermost call is recorded
+    
+    def run():
+        for i in range(100):
+            with timers.timer('run'):
+                step()
+                rec(5)
+    
+    threads = [threading.Thread(target=run) for i in range(4)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    results = timers.report(output=True)
+    assert list(results.keys()) == ['run', 'run/step', 'run/rec'] # Parents before children
+    assert all([stats['count'] == 400 for stats in results.values()]) # Nothing lost between threads
+    assert results['run']['total'] >= results['run/rec']['total']
+    timers.enabled = False
+    with timers.timer('off'): pass
+    assert 'off' not in timers.report(output=True)
+    
+    @sc.timer
+    def decorated(): pass
+    decorated()
+    assert sc.timers['decorated']['count'] == 1
+    sc.timers.report()
+
+
+if 'memoize' in torun:
+    import time
+    import threading
+    calls = []
+    
+    @sc.memoize(maxsize=2)
+    def total(arr, opts=None):
+        calls.append(1)
+        return arr.sum()
+    
+    arr = np.arange(10.)
+    total(arr)
+    total(arr.copy()) # Arrays are compared by value
+    total(arr, opts=sc.odict(a=1))
+    total(arr, opts=sc.odict(a=1)) # So are odicts
+    assert len(calls) == 2 and total.cache_info()['hits'] == 2
+    total(arr+1) # Evicts total(arr), the least recently used
+    total(arr, opts=sc.odict(a=1))
+    total(arr)
+    assert len(calls) == 4 and total.cache_info()['evictions'] == 2 and total.cache_info()['size'] == 2
+    total.cache_clear()
+    assert total.cache_info()['size'] == total.cache_info()['hits'] == 0
+    
+    @sc.memoize
+    def nrows(df): return df.nrows()
+    df = sc.dataframe(cols=['x'], data=[[1],[2]])
+    assert nrows(df) == 2
+    df.addrow([3])
+    assert nrows(df) == 3 # Changed in place, so not the cached result
+    
+    @sc.memoize(maxsize=None, maxbytes=2e5)
+    def zeros(n): return np.zeros(n)
+    for n in range(10000, 10005): zeros(n) # 80 kB each
+    assert zeros.cache_info()['size'] == 2 and zeros.cache_info()['nbytes'] <= 2e5
+    zeros(100000) # Larger than maxbytes, so not stored
+    assert zeros.cache_info()['size'] == 2
+    
+    @sc.memoize(ttl=0.1)
+    def stamp(x): return time.time()
+    first = stamp(1)
+    assert stamp(1) == first
+    time.sleep(0.2)
+    assert stamp(1) != first # Expired
+    
+    @sc.memoize(maxsize=3)
+    def identity(x): return x
+    def run():
+        for i in range(1000):
+            assert identity(i%5) == i%5
+    threads = [threading.Thread(target=run) for i in range(4)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    info = identity.cache_info()
+    assert info['hits'] + info['misses'] == 4000 and info['size'] == 3
+
+
+if 'hashobj' in torun:
+    import subprocess
+    import sys
+    project = sc.prettyobj()
+    project.pars = sc.odict(a=np.arange(5.), b=[1, 2.5, 'x', None, True, 3+1j], c={'z':1, 'y':(1,2)}, d={1, 'a'})
+    project.data = sc.dataframe(cols=['x','y'], data=[[1,'a'],[2,'b']])
+    project.pars['self'] = project.pars # Cycles are fine
+    digest = sc.hashobj(project)
+    assert sc.hashobj(sc.dcp(project)) == digest
+    changed = sc.dcp(project)
+    changed.pars['a'][3] = 0
+    assert sc.hashobj(changed) != digest
+    changed = sc.dcp(project)
+    changed.data.data[0,0] = 5
+    assert sc.hashobj(changed) != digest
+    
+    # Things which are equal hash the same, and things which aren't don't
+    assert sc.hashobj({'a':1, 'b':2}) == sc.hashobj({'b':2, 'a':1}) # Dict order doesn't matter...
+    assert sc.hashobj(sc.odict(a=1, b=2)) != sc.hashobj(sc.odict(b=2, a=1)) # ...but odict order does
+    assert len(set([sc.hashobj(x) for x in [1, 1.0, True, '1', b'1', [1], (1,), {1}, np.int64(1), np.array([1])]])) == 10
+    assert sc.hashobj(np.arange(6).reshape(2,3)) != sc.hashobj(np.arange(6).reshape(3,2))
+    big = np.random.rand(1000, 100)
+    assert sc.hashobj(big[:,::2]) == sc.hashobj(big[:,::2].copy()) # Non-contiguous arrays
+    
+    # Subclasses of builtin containers are hashed by their contents
+    assert sc.hashobj(List([1])) != sc.hashobj(List([2]))
+    assert sc.hashobj(Dict(a=1)) != sc.hashobj(Dict(a=2))
+    assert sc.hashobj(List([1])) != sc.hashobj([1])
+    items = List([1])
+    items.label = 'Items'
+    assert sc.hashobj(items) != sc.hashobj(List([1])) # Attributes are included too
+    
+    # Functions are hashed by their code, defaults, and closures
+    def make(k): return lambda x: x*k
+    def withdefault(x, k=1): return x*k
+    def withkwdefault(x, *, k=1): return x*k
+    assert sc.hashobj(lambda x: x+1) != sc.hashobj(lambda x: x+2) # Constants
+    assert sc.hashobj(lambda x: x.a) != sc.hashobj(lambda x: x.b) # Names
+    assert sc.hashobj(lambda: (lambda: 1)) != sc.hashobj(lambda: (lambda: 2)) # Nested code
+    assert sc.hashobj(make(2)) != sc.hashobj(make(3)) and sc.hashobj(make(2)) == sc.hashobj(make(2)) # Closures
+    defaults = sc.hashobj(withdefault)
+    withdefault.__defaults__ = (2,)
+    assert sc.hashobj(withdefault) != defaults
+    kwdefaults = sc.hashobj(withkwdefault)
+    withkwdefault.__kwdefaults__ = {'k':2}
+    assert sc.hashobj(withkwdefault) != kwdefaults
+    holder = sc.prettyobj()
+    holder.func = lambda: 1
+    before = sc.hashobj(holder)
+    holder.func = lambda: 2
+    assert sc.hashobj(holder) != before
+    
+    # The same in a new process, e.g. with a different hash seed
+    code = 'import sciris as sc; print(sc.hashobj(sc.odict(a=[1, 2.5, "x"], b={"c", "d"})))'
+    assert subprocess.check_output([sys.executable, '-c', code]).decode().strip() == sc.hashobj(sc.odict(a=[1, 2.5, 'x'], b={'c', 'd'}))
+    assert len(sc.hashobj(project, algorithm='sha256')) == 64
+
 
 # Run tests for odict
 from sciris import odict as od